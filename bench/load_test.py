@@ -0,0 +1,494 @@
+"""
+Throughput and latency of the main endpoints under load.
+
+Starts a throwaway PostgreSQL with initdb and pg_ctl (from PATH or --pg-bin),
+creates the chopchop schema from bench/schema.sql and sql/migrations, seeds it
+and serves src/main.py with uvicorn. Each scenario is then driven at every
+concurrency level and the results are saved as JSON, to be compared between
+versions:
+
+    python bench/load_test.py --verified 100000 --concurrency 1 16 64 --output new.json
+    python bench/load_test.py --compare old.json new.json
+
+PostgreSQL refuses to run as root. --database-url uses an existing database
+instead, its chopchop schema is replaced only when --reset is given.
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import re
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import httpx
+import jwt
+import psycopg
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SCENARIOS = ["get_product", "list_products", "post_product", "post_purchase"]
+
+CATEGORIES = [
+    "artesanal", "antiguitats", "cosmetica", "cuina", "electrodomestics", "electronica",
+    "equipament_lab", "esports", "ferramentes", "infantil", "instruments", "jardineria",
+    "jocs_de_taula", "joies_complements_accessoris", "llibres", "mascotes", "mobles",
+    "neteja", "roba", "sabates", "vehicles", "videojocs", "altres",
+]
+WORDS = [
+    "taula", "cadira", "bicicleta", "llibre", "làmpada", "sofà", "guitarra", "ordinador",
+    "portàtil", "sabates", "jaqueta", "rellotge", "càmera", "telèfon", "patinet", "nevera",
+    "cafetera", "joguina", "puzzle", "motxilla", "mesa", "silla", "libro", "lámpara",
+]
+ADJECTIVES = [
+    "vella", "nova", "vermella", "blava", "gran", "petita", "antiga", "moderna",
+    "fusta", "metall", "elèctrica", "usada", "restaurada", "professional", "infantil",
+]
+
+# Run in order in one transaction. Everything but the ids is derived from the
+# row number and setseed(), so the same arguments produce the same data
+SEED_STATEMENTS = [
+    "SELECT setseed(%(seed)s)",
+    """
+    CREATE TEMPORARY TABLE seed_product ON COMMIT DROP AS
+    SELECT n, gen_random_uuid() AS product_id, now() - random() * interval '365 days' AS created_at
+    FROM generate_series(1, %(verified)s + %(secondhand)s) AS n
+    """,
+    """
+    INSERT INTO chopchop.product_id (product_id, created_at)
+    SELECT product_id, created_at FROM seed_product
+    """,
+    """
+    INSERT INTO chopchop.verified_product (vp_id, vp_owner, vp_sku, vp_name, vp_description, vp_stock, vp_price, vp_image, vp_category)
+    SELECT
+        product_id,
+        md5('seller' || n %% 200)::uuid,
+        'SKU-' || n,
+        words[1 + n %% cardinality(words)] || ' ' || adjectives[1 + n / 7 %% cardinality(adjectives)] || ' ' || n,
+        'Una ' || words[1 + n * 11 %% cardinality(words)] || ' en bon estat, ideal per ' || words[1 + n * 17 %% cardinality(words)],
+        1000000000,
+        round((1 + random() * 500)::numeric, 2),
+        'https://example.com/' || n || '.jpg',
+        categories[1 + n %% cardinality(categories)]
+    FROM seed_product,
+        (SELECT %(words)s::text[] AS words, %(adjectives)s::text[] AS adjectives, %(categories)s::text[] AS categories) AS vocabulary
+    WHERE n <= %(verified)s
+    """,
+    """
+    INSERT INTO chopchop.secondhand_product (sp_id, sp_owner, sp_name, sp_description, sp_price, sp_image, sp_category)
+    SELECT
+        product_id,
+        md5('particular' || n %% 1000)::uuid,
+        words[1 + n %% cardinality(words)] || ' usada ' || n,
+        'De segona mà, ' || adjectives[1 + n %% cardinality(adjectives)],
+        round((1 + random() * 200)::numeric, 2),
+        'https://example.com/' || n || '.jpg',
+        categories[1 + n * 3 %% cardinality(categories)]
+    FROM seed_product,
+        (SELECT %(words)s::text[] AS words, %(adjectives)s::text[] AS adjectives, %(categories)s::text[] AS categories) AS vocabulary
+    WHERE n > %(verified)s
+    """,
+    """
+    CREATE TEMPORARY TABLE seed_purchase ON COMMIT DROP AS
+    SELECT n, gen_random_uuid() AS pu_id, md5('buyer' || n %% 1000)::uuid AS pu_user_id, now() - random() * interval '365 days' AS pu_date
+    FROM generate_series(1, %(purchases)s) AS n
+    """,
+    """
+    INSERT INTO chopchop.purchase (pu_id, pu_user_id, pu_date)
+    SELECT pu_id, pu_user_id, pu_date FROM seed_purchase
+    """,
+    # One to three items per purchase
+    """
+    INSERT INTO chopchop.purchase_item (pi_purchase_id, pi_product_id, pi_count, pi_paid)
+    SELECT DISTINCT ON (pu_id, vp_id) pu_id, vp_id, units, vp_price * units
+    FROM seed_purchase
+    CROSS JOIN generate_series(1, 1 + seed_purchase.n %% 3) AS item
+    CROSS JOIN LATERAL (SELECT 1 + item %% 3 AS units) AS line
+    JOIN seed_product ON seed_product.n = 1 + (seed_purchase.n * 7919 + item * 104729) %% greatest(%(verified)s, 1)
+    JOIN chopchop.verified_product ON vp_id = seed_product.product_id
+    """,
+]
+
+
+def percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] if latencies else None
+
+
+@contextmanager
+def local_postgres(pg_bin):
+    data = tempfile.mkdtemp(prefix="chopchop-bench-")
+    initdb = os.path.join(pg_bin, "initdb") if pg_bin else "initdb"
+    pg_ctl = os.path.join(pg_bin, "pg_ctl") if pg_bin else "pg_ctl"
+
+    subprocess.run(
+        [initdb, "-D", data, "-U", "postgres",
+            "--auth=trust", "-E", "UTF8", "--no-sync"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    # Only a unix socket inside the data directory, nothing listens on the network
+    subprocess.run(
+        [pg_ctl, "-D", data, "-l", os.path.join(data, "postgres.log"), "-w", "start",
+         "-o", f"-c listen_addresses='' -k {data} -c max_connections=200"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+
+    try:
+        yield f"postgresql://postgres@/postgres?host={data}"
+
+    finally:
+        subprocess.run([pg_ctl, "-D", data, "-m", "fast",
+                       "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(data, ignore_errors=True)
+
+
+def create_schema(url, reset):
+    with psycopg.connect(url, autocommit=True) as conn:
+        exists = conn.execute(
+            "SELECT FROM pg_namespace WHERE nspname = 'chopchop'").fetchone()
+        if exists and not reset:
+            sys.exit(
+                "The database already has a chopchop schema, pass --reset to replace it")
+        if exists:
+            conn.execute("DROP SCHEMA chopchop CASCADE")
+
+        for path in [os.path.join(ROOT, "bench", "schema.sql"), *sorted(glob.glob(os.path.join(ROOT, "sql", "migrations", "*.sql")))]:
+            with open(path) as file:
+                conn.execute(file.read())
+
+
+def seed(url, args):
+    started = time.perf_counter()
+    with psycopg.connect(url) as conn:
+        params = {
+            "seed": args.seed,
+            "verified": args.verified,
+            "secondhand": args.secondhand,
+            "purchases": args.purchases,
+            "words": WORDS,
+            "adjectives": ADJECTIVES,
+            "categories": CATEGORIES,
+        }
+        for statement in SEED_STATEMENTS:
+            conn.execute(statement, params)
+
+    with psycopg.connect(url, autocommit=True) as conn:
+        conn.execute("VACUUM ANALYZE")
+        verified = [row[0] for row in conn.execute(
+            "SELECT vp_id FROM chopchop.verified_product ORDER BY vp_id LIMIT 10000")]
+        secondhand = [row[0] for row in conn.execute(
+            "SELECT sp_id FROM chopchop.secondhand_product ORDER BY sp_id LIMIT 10000")]
+
+    print(f"seeded {args.verified} verified, {args.secondhand} secondhand products and "
+          f"{args.purchases} purchases in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return verified, secondhand
+
+
+def admission_env(enabled):
+    """
+    Rate limits and the pool's waiting queue would answer most of the load
+    with 429 and 503, the benchmark measures the API behind them unless asked
+    """
+    if enabled:
+        return {}
+
+    return {"RATE_LIMIT_USER_RATE": "0", "RATE_LIMIT_IP_RATE": "0", "DATABASE_POOL_MAX_WAITING": "0"}
+
+
+@contextmanager
+def run_api(url, port, workers, secret_key, settings):
+    env = {**os.environ, "DATABASE_URL": url,
+           "DATABASE_LISTEN_URL": url, "SECRET_KEY": secret_key, **settings}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:api", "--app-dir", os.path.join(ROOT, "src"),
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/stats/database").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+
+            if server.poll() is not None or time.monotonic() > deadline:
+                sys.exit("The API did not start")
+            time.sleep(0.2)
+
+        yield f"http://127.0.0.1:{port}"
+
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def token(secret_key, user_type):
+    payload = {
+        "sub": str(uuid4()),
+        "type": user_type,
+        "name": "Bench",
+        "surname": "User",
+        "nif": "00000000T",
+        "exp": int(time.time()) + 24 * 3600,
+    }
+    return {"Authorization": "Bearer " + jwt.encode(payload, secret_key, algorithm="HS256")}
+
+
+def make_requests(verified, secondhand, secret_key):
+    """Request (method, url, keyword arguments) of each scenario, from a random generator"""
+    professional = token(secret_key, "professional")
+    particular = token(secret_key, "particular")
+    products = verified + secondhand
+
+    def get_product(rng):
+        return "GET", f"/product/{rng.choice(products)}", {}
+
+    def list_products(rng):
+        params = {"page": rng.randrange(3)}
+        if rng.random() < 0.5:
+            params["category"] = rng.choice(CATEGORIES)
+        if rng.random() < 0.5:
+            params["min_price"] = rng.randrange(0, 100)
+            params["max_price"] = params["min_price"] + rng.randrange(10, 400)
+        if rng.random() < 0.3:
+            params["query"] = rng.choice(WORDS)
+        return "GET", "/products", {"params": params}
+
+    def post_product(rng):
+        product = {
+            "type": "verified",
+            "sku": f"BENCH-{rng.getrandbits(48):x}",
+            "name": f"{rng.choice(WORDS)} {rng.choice(ADJECTIVES)}",
+            "description": "Producte del benchmark",
+            "stock": 100,
+            "price": round(rng.uniform(1, 500), 2),
+            "image": "",
+            "category": rng.choice(CATEGORIES),
+        }
+        return "POST", "/product", {"json": product, "headers": professional}
+
+    def post_purchase(rng):
+        items = [
+            {"product_id": str(product_id), "count": 1, "paid": 1.0}
+            for product_id in rng.sample(verified, rng.randint(1, 3))
+        ]
+        return "POST", "/purchase", {"json": items, "headers": particular}
+
+    return {
+        "get_product": get_product,
+        "list_products": list_products,
+        "post_product": post_product,
+        "post_purchase": post_purchase,
+    }
+
+
+async def drive(base_url, scenario, make_request, concurrency, duration, warmup, seed):
+    latencies = []
+    errors = 0
+    statuses = {}
+
+    async def user(rng, client, measure_from, deadline):
+        nonlocal errors
+        while (now := time.monotonic()) < deadline:
+            method, url, kwargs = make_request(rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = str(response.status_code)
+
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+
+            elapsed = time.perf_counter() - started
+            if now >= measure_from:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+                if not status.startswith("2"):
+                    errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        measure_from = time.monotonic() + warmup
+        deadline = measure_from + duration
+        await asyncio.gather(*(
+            user(random.Random(f"{seed}-{scenario}-{i}"),
+                 client, measure_from, deadline)
+            for i in range(concurrency)
+        ))
+
+    latencies.sort()
+    result = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "throughput": len(latencies) / duration,
+        "p50_ms": None,
+        "p95_ms": None,
+        "p99_ms": None,
+    }
+    for name, fraction in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        if latencies:
+            result[name] = percentile(latencies, fraction) * 1000
+
+    print(
+        f"{scenario:14} concurrency={concurrency:4} req/s={result['throughput']:8.1f} "
+        f"p50={result['p50_ms'] or 0:7.2f}ms p95={result['p95_ms'] or 0:7.2f}ms "
+        f"p99={result['p99_ms'] or 0:7.2f}ms errors={errors}",
+        file=sys.stderr,
+    )
+    return result
+
+
+def version():
+    with open(os.path.join(ROOT, "src", "main.py")) as file:
+        match = re.search(r'__version__ = "([^"]+)"', file.read())
+
+    try:
+        commit = subprocess.run(
+            ["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return match.group(1) if match else None, commit
+
+
+def benchmark(args):
+    secret_key = secrets.token_hex(32)
+    api_version, commit = version()
+    # Recorded in the report, reports made with different limits don't compare
+    settings = admission_env(args.admission_control)
+    for name, value in os.environ.items():
+        if name.startswith(("RATE_LIMIT_", "DATABASE_POOL_")):
+            settings.setdefault(name, value)
+    report = {
+        "version": api_version,
+        "commit": commit,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "verified": args.verified,
+            "secondhand": args.secondhand,
+            "purchases": args.purchases,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "workers": args.workers,
+            "seed": args.seed,
+            "admission_control": args.admission_control,
+            "settings": settings,
+        },
+        "results": [],
+    }
+
+    with local_postgres(args.pg_bin) if args.database_url is None else nullcontext(args.database_url) as url:
+        create_schema(url, args.reset or args.database_url is None)
+        verified, secondhand = seed(url, args)
+        requests = make_requests(verified, secondhand, secret_key)
+
+        with run_api(url, args.port, args.workers, secret_key, settings) as base_url:
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    report["results"].append(asyncio.run(drive(
+                        base_url, scenario, requests[scenario], concurrency,
+                        args.duration, args.warmup, args.seed,
+                    )))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+def compare(old_path, new_path, threshold):
+    """Throughput and p99 changes between two reports, slower results are flagged"""
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+
+    old_results = {
+        (result["scenario"], result["concurrency"]): result for result in old["results"]
+    }
+    print(f"{old.get('version')} ({old.get('commit')}) -> {new.get('version')} ({new.get('commit')})")
+
+    regressions = 0
+    for result in new["results"]:
+        before = old_results.get((result["scenario"], result["concurrency"]))
+        if before is None or not before["throughput"] or not before["p99_ms"] or not result["p99_ms"]:
+            continue
+
+        throughput = result["throughput"] / before["throughput"] - 1
+        p99 = result["p99_ms"] / before["p99_ms"] - 1
+        regressed = throughput < -threshold or p99 > threshold
+        regressions += regressed
+
+        print(
+            f"{result['scenario']:14} concurrency={result['concurrency']:4} "
+            f"req/s {before['throughput']:8.1f} -> {result['throughput']:8.1f} ({throughput:+6.1%}) "
+            f"p99 {before['p99_ms']:7.2f} -> {result['p99_ms']:7.2f}ms ({p99:+6.1%})"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", default=None,
+                        help="use this database instead of starting one")
+    parser.add_argument("--reset", action="store_true",
+                        help="replace the chopchop schema of --database-url")
+    parser.add_argument("--pg-bin", default=None,
+                        help="directory with initdb and pg_ctl, defaults to PATH")
+    parser.add_argument("--verified", type=int, default=20000)
+    parser.add_argument("--secondhand", type=int, default=5000)
+    parser.add_argument("--purchases", type=int, default=10000)
+    parser.add_argument("--scenarios", nargs="+",
+                        choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int,
+                        nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds measured for each scenario and concurrency")
+    parser.add_argument("--warmup", type=float, default=2,
+                        help="seconds run before measuring")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="uvicorn workers")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--admission-control", action="store_true",
+                        help="keep the API's rate limits and pool waiting queue, disabled by default")
+    parser.add_argument("--seed", type=float, default=0.42,
+                        help="random seed of the data and the requests, between -1 and 1")
+    parser.add_argument("--output", default=None,
+                        help="write the JSON report here")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two reports instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change flagged as a regression by --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
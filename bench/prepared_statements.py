@@ -0,0 +1,121 @@
+"""
+Time saved by running the hot statements as prepared statements.
+
+The statements are captured by running the model methods once, then each is
+executed repeatedly on one connection, unprepared (parsed and planned every
+time) and prepared (planned once per connection). The planning time reported
+by EXPLAIN is the part a prepared statement skips.
+
+Needs a seeded database with the chopchop schema and the migrations in
+sql/migrations, bench/load_test.py --database-url can create one:
+
+    DATABASE_URL=postgresql://... python bench/prepared_statements.py --executions 2000
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+
+from psycopg import AsyncConnection, AsyncCursor, sql
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from model.product.product import Product, product_cache  # noqa: E402
+
+DATABASE_URL = os.getenv("DATABASE_URL", "Database url missing!!")
+
+
+class RecordingCursor(AsyncCursor):
+    """Keeps the statements it runs, so the benchmark replays exactly what the models send"""
+
+    statements = []
+
+    async def execute(self, query, params=None, **kwargs):
+        self.statements.append((query, params))
+        return await super().execute(query, params, **kwargs)
+
+
+async def capture(conn):
+    cursor = conn.cursor()
+    await cursor.execute("SELECT vp_id FROM chopchop.verified_product LIMIT 1")
+    product_id = (await cursor.fetchone())[0]
+
+    captured = {}
+
+    async def run(name, method, *args):
+        product_cache.clear()
+        RecordingCursor.statements = []
+        async with RecordingCursor(conn) as recording:
+            await method(recording, *args)
+        captured[name] = RecordingCursor.statements[-1]
+
+    listing = await Product.get_products(cursor, None, 0, None, 0.0, float("inf"), Product.Sort.PRICE_ASC)
+
+    await run("Product.factory", Product.factory, product_id)
+    await run("get_products newest", Product.get_products,
+              None, 0, None, 0.0, float("inf"))
+    await run("get_products category+price", Product.get_products,
+              None, 1, Product.Category.MOBLES, 10.0, 200.0, Product.Sort.PRICE_ASC)
+    await run("get_products next page", Product.get_products,
+              None, 0, None, 0.0, float("inf"), Product.Sort.PRICE_ASC, listing["next_cursor"])
+    return captured
+
+
+async def planning_time(conn, query, params):
+    query = query if isinstance(query, sql.Composable) else sql.SQL(query)
+    async with AsyncCursor(conn) as cursor:
+        await cursor.execute(sql.SQL("EXPLAIN (ANALYZE, SUMMARY) ") + query, params, prepare=False)
+        plan = "\n".join(row[0] for row in await cursor.fetchall())
+
+    return float(re.search(r"Planning Time: ([\d.]+) ms", plan).group(1))
+
+
+async def time_executions(conn, query, params, executions, prepare):
+    latencies = []
+    async with AsyncCursor(conn) as cursor:
+        for _ in range(executions):
+            started = time.perf_counter()
+            await cursor.execute(query, params, prepare=prepare)
+            await cursor.fetchall()
+            latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    return sum(latencies) / len(latencies), latencies[len(latencies) // 2]
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--executions", type=int, default=1000,
+                        help="executions of each statement in each mode")
+    parser.add_argument("--plan-cache-mode", default="auto",
+                        choices=["auto", "force_custom_plan",
+                                 "force_generic_plan"],
+                        help="plan_cache_mode of the prepared executions")
+    args = parser.parse_args()
+
+    async with await AsyncConnection.connect(DATABASE_URL, autocommit=True, prepare_threshold=None) as conn:
+        statements = await capture(conn)
+
+        print(
+            f"{'statement':30} {'planning':>9} {'unprepared':>11} {'prepared':>9} {'saved':>8}")
+        for name, (query, params) in statements.items():
+            planning = await planning_time(conn, query, params)
+            # Warm the caches so both modes read the same pages
+            await time_executions(conn, query, params, 10, False)
+            unprepared, _ = await time_executions(conn, query, params, args.executions, False)
+            await conn.execute(sql.SQL("SET plan_cache_mode = {}").format(sql.Literal(args.plan_cache_mode)))
+            prepared, _ = await time_executions(conn, query, params, args.executions, True)
+            await conn.execute("RESET plan_cache_mode")
+
+            print(
+                f"{name:30} {planning:7.3f}ms {unprepared * 1000:9.3f}ms {prepared * 1000:7.3f}ms "
+                f"{(1 - prepared / unprepared):+7.1%}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
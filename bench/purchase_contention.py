@@ -0,0 +1,119 @@
+"""
+Checkout throughput when many buyers purchase the same SKU at once.
+
+Every buyer runs Purchase.insert in its own transaction against one verified
+product, so all of them contend for the same stock row. At the end the stock
+and sold counters are checked against the number of accepted purchases to
+make sure nothing was oversold.
+
+Needs a database with the chopchop schema and the migrations in sql/migrations:
+
+    DATABASE_URL=postgresql://... python bench/purchase_contention.py --concurrency 1 8 32 64
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from uuid import uuid4
+
+from fastapi import HTTPException
+from psycopg_pool import AsyncConnectionPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from model.purchase import Purchase  # noqa: E402
+from model.user import Particular  # noqa: E402
+
+DATABASE_URL = os.getenv("DATABASE_URL", "Database url missing!!")
+
+
+async def create_product(pool, stock):
+    async with pool.connection() as conn:
+        cursor = await conn.execute(
+            "INSERT INTO chopchop.product_id DEFAULT VALUES RETURNING product_id")
+        product_id = (await cursor.fetchone())[0]
+
+        await conn.execute(
+            """
+            INSERT INTO chopchop.verified_product (vp_id, vp_owner, vp_sku, vp_name, vp_description, vp_stock, vp_price, vp_image, vp_category)
+            VALUES (%s, %s, 'BENCH', 'Contention benchmark', '', %s, 1, '', 'altres')
+            """,
+            (product_id, uuid4(), stock),
+        )
+
+    return product_id
+
+
+async def buyer(pool, product_id, purchases, results):
+    user = Particular(id=uuid4(), name="Bench", surname="Buyer")
+    item = Purchase.PurchaseItem(product_id=product_id, count=1, paid=1.0)
+
+    for _ in range(purchases):
+        started = time.perf_counter()
+        try:
+            async with pool.connection() as conn:
+                async with conn.transaction():
+                    async with conn.cursor() as cursor:
+                        await Purchase(user).insert(cursor, [item])
+            results["accepted"] += 1
+
+        except HTTPException as e:
+            if e.status_code != 409:
+                raise
+            results["rejected"] += 1
+
+        results["latencies"].append(time.perf_counter() - started)
+
+
+async def run(concurrency, purchases, stock):
+    async with AsyncConnectionPool(
+        DATABASE_URL, min_size=concurrency, max_size=concurrency, open=False
+    ) as pool:
+        product_id = await create_product(pool, stock)
+        results = {"accepted": 0, "rejected": 0, "latencies": []}
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(buyer(pool, product_id, purchases, results) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - started
+
+        async with pool.connection() as conn:
+            cursor = await conn.execute(
+                "SELECT vp_stock, vp_sold FROM chopchop.verified_product WHERE vp_id = %s",
+                (product_id,),
+            )
+            final_stock, sold = await cursor.fetchone()
+
+    latencies = sorted(results["latencies"])
+    consistent = sold == results["accepted"] and final_stock == stock - sold
+
+    print(
+        f"concurrency={concurrency:4} "
+        f"checkouts/s={len(latencies) / elapsed:8.1f} "
+        f"accepted={results['accepted']:6} rejected={results['rejected']:6} "
+        f"p50={latencies[len(latencies) // 2] * 1000:7.2f}ms "
+        f"p99={latencies[int(len(latencies) * 0.99)] * 1000:7.2f}ms "
+        f"stock={final_stock} sold={sold} {'ok' if consistent else 'OVERSOLD'}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--purchases", type=int, default=50,
+                        help="purchases made by each buyer")
+    parser.add_argument("--stock", type=int, default=None,
+                        help="initial stock, defaults to 80%% of the purchases so some get rejected")
+    args = parser.parse_args()
+
+    for concurrency in args.concurrency:
+        total = concurrency * args.purchases
+        stock = args.stock if args.stock is not None else int(total * 0.8)
+        await run(concurrency, args.purchases, stock)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+-- Base chopchop schema used by the benchmarks: the tables and columns the API
+-- reads and writes, as they are before sql/migrations is applied. Only meant
+-- for throwaway databases, the production schema is managed in Supabase.
+CREATE SCHEMA chopchop;
+
+CREATE TABLE chopchop.product_id (
+    product_id uuid PRIMARY KEY DEFAULT gen_random_uuid()
+);
+
+CREATE TABLE chopchop.verified_product (
+    vp_id uuid PRIMARY KEY REFERENCES chopchop.product_id (product_id) ON DELETE CASCADE,
+    vp_owner uuid NOT NULL,
+    vp_sku text NOT NULL,
+    vp_name text NOT NULL,
+    vp_description text NOT NULL DEFAULT '',
+    vp_stock integer NOT NULL DEFAULT 0,
+    vp_price numeric(10, 2) NOT NULL,
+    vp_image text NOT NULL DEFAULT '',
+    vp_category text NOT NULL DEFAULT 'altres',
+    vp_sold integer NOT NULL DEFAULT 0
+);
+
+CREATE TABLE chopchop.secondhand_product (
+    sp_id uuid PRIMARY KEY REFERENCES chopchop.product_id (product_id) ON DELETE CASCADE,
+    sp_owner uuid NOT NULL,
+    sp_name text NOT NULL,
+    sp_description text NOT NULL DEFAULT '',
+    sp_price numeric(10, 2) NOT NULL,
+    sp_image text NOT NULL DEFAULT '',
+    sp_category text NOT NULL DEFAULT 'altres'
+);
+
+CREATE TABLE chopchop.purchase (
+    pu_id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    pu_user_id uuid NOT NULL,
+    pu_date timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE chopchop.purchase_item (
+    pi_purchase_id uuid NOT NULL REFERENCES chopchop.purchase (pu_id),
+    pi_product_id uuid NOT NULL REFERENCES chopchop.product_id (product_id),
+    pi_count integer NOT NULL,
+    pi_paid numeric(10, 2) NOT NULL,
+    PRIMARY KEY (pi_purchase_id, pi_product_id)
+);
@@ -16,6 +16,8 @@
                 dependencies = with pkgs.python312Packages; [
                     fastapi
                     psycopg
+                    psycopg-pool
+                    prometheus-client
                     pydantic
                     pyjwt
                 ];
@@ -26,6 +28,10 @@
                     python-lsp-server
                     python-lsp-ruff
                     autopep8
+
+                    # bench/load_test.py
+                    httpx
+                    uvicorn
                 ];
 
             in { 
@@ -0,0 +1,4 @@
+-- Creation time of every product, used to sort listings by newest first.
+-- Existing products get the time the migration runs.
+ALTER TABLE chopchop.product_id
+    ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
@@ -0,0 +1,96 @@
+-- Unified catalog of verified and secondhand products, used by the product
+-- listings instead of a UNION of both tables. It is kept in sync by triggers
+-- on the product tables, so every write path (including COPY) maintains it.
+CREATE TABLE IF NOT EXISTS chopchop.product_catalog (
+    pc_id uuid PRIMARY KEY REFERENCES chopchop.product_id (product_id) ON DELETE CASCADE,
+    pc_type text NOT NULL CHECK (pc_type IN ('verified', 'secondhand')),
+    pc_name text NOT NULL,
+    pc_image text NOT NULL,
+    pc_price numeric NOT NULL,
+    pc_category text NOT NULL,
+    pc_created_at timestamptz NOT NULL
+);
+
+-- Every sort order of GET /products, with and without a category filter.
+-- The id is part of each key so keyset pagination is a single index range
+CREATE INDEX IF NOT EXISTS product_catalog_price_idx
+    ON chopchop.product_catalog (pc_price, pc_id);
+CREATE INDEX IF NOT EXISTS product_catalog_created_at_idx
+    ON chopchop.product_catalog (pc_created_at, pc_id);
+CREATE INDEX IF NOT EXISTS product_catalog_category_price_idx
+    ON chopchop.product_catalog (pc_category, pc_price, pc_id);
+CREATE INDEX IF NOT EXISTS product_catalog_category_created_at_idx
+    ON chopchop.product_catalog (pc_category, pc_created_at, pc_id);
+
+
+CREATE OR REPLACE FUNCTION chopchop.sync_verified_product_catalog() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM chopchop.product_catalog WHERE pc_id = OLD.vp_id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO chopchop.product_catalog (pc_id, pc_type, pc_name, pc_image, pc_price, pc_category, pc_created_at)
+    SELECT NEW.vp_id, 'verified', NEW.vp_name, NEW.vp_image, NEW.vp_price, NEW.vp_category::text, created_at
+    FROM chopchop.product_id
+    WHERE product_id = NEW.vp_id
+    ON CONFLICT (pc_id) DO UPDATE SET
+        pc_name = EXCLUDED.pc_name,
+        pc_image = EXCLUDED.pc_image,
+        pc_price = EXCLUDED.pc_price,
+        pc_category = EXCLUDED.pc_category;
+
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION chopchop.sync_secondhand_product_catalog() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM chopchop.product_catalog WHERE pc_id = OLD.sp_id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO chopchop.product_catalog (pc_id, pc_type, pc_name, pc_image, pc_price, pc_category, pc_created_at)
+    SELECT NEW.sp_id, 'secondhand', NEW.sp_name, NEW.sp_image, NEW.sp_price, NEW.sp_category::text, created_at
+    FROM chopchop.product_id
+    WHERE product_id = NEW.sp_id
+    ON CONFLICT (pc_id) DO UPDATE SET
+        pc_name = EXCLUDED.pc_name,
+        pc_image = EXCLUDED.pc_image,
+        pc_price = EXCLUDED.pc_price,
+        pc_category = EXCLUDED.pc_category;
+
+    RETURN NEW;
+END
+$$;
+
+-- Stock and sold counters change on every purchase, they are not part of the
+-- catalog so updates that only touch them don't fire the trigger
+DROP TRIGGER IF EXISTS verified_product_catalog ON chopchop.verified_product;
+CREATE TRIGGER verified_product_catalog
+    AFTER INSERT OR DELETE OR UPDATE OF vp_name, vp_image, vp_price, vp_category
+    ON chopchop.verified_product
+    FOR EACH ROW EXECUTE FUNCTION chopchop.sync_verified_product_catalog();
+
+DROP TRIGGER IF EXISTS secondhand_product_catalog ON chopchop.secondhand_product;
+CREATE TRIGGER secondhand_product_catalog
+    AFTER INSERT OR DELETE OR UPDATE OF sp_name, sp_image, sp_price, sp_category
+    ON chopchop.secondhand_product
+    FOR EACH ROW EXECUTE FUNCTION chopchop.sync_secondhand_product_catalog();
+
+
+-- Backfill the products that existed before the catalog
+INSERT INTO chopchop.product_catalog (pc_id, pc_type, pc_name, pc_image, pc_price, pc_category, pc_created_at)
+SELECT vp_id, 'verified', vp_name, vp_image, vp_price, vp_category::text, created_at
+FROM chopchop.verified_product
+JOIN chopchop.product_id ON product_id = vp_id
+ON CONFLICT (pc_id) DO NOTHING;
+
+INSERT INTO chopchop.product_catalog (pc_id, pc_type, pc_name, pc_image, pc_price, pc_category, pc_created_at)
+SELECT sp_id, 'secondhand', sp_name, sp_image, sp_price, sp_category::text, created_at
+FROM chopchop.secondhand_product
+JOIN chopchop.product_id ON product_id = sp_id
+ON CONFLICT (pc_id) DO NOTHING;
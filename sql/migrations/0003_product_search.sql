@@ -0,0 +1,109 @@
+-- Full-text and typo tolerant search over the product catalog: a weighted
+-- Catalan/Spanish tsvector of the name and description, plus trigrams of the
+-- name to match misspelled queries.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- The catalan configuration ships with PostgreSQL 16 onwards, fall back to
+-- unstemmed matching on older servers
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT FROM pg_ts_config c
+        JOIN pg_namespace n ON n.oid = c.cfgnamespace
+        WHERE n.nspname = 'chopchop' AND c.cfgname = 'catalan'
+    ) THEN
+        IF EXISTS (SELECT FROM pg_ts_config WHERE cfgname = 'catalan') THEN
+            CREATE TEXT SEARCH CONFIGURATION chopchop.catalan (COPY = pg_catalog.catalan);
+        ELSE
+            CREATE TEXT SEARCH CONFIGURATION chopchop.catalan (COPY = pg_catalog.simple);
+        END IF;
+    END IF;
+END
+$$;
+
+
+ALTER TABLE chopchop.product_catalog
+    ADD COLUMN IF NOT EXISTS pc_description text NOT NULL DEFAULT '';
+
+UPDATE chopchop.product_catalog
+SET pc_description = vp_description
+FROM chopchop.verified_product
+WHERE vp_id = pc_id;
+
+UPDATE chopchop.product_catalog
+SET pc_description = sp_description
+FROM chopchop.secondhand_product
+WHERE sp_id = pc_id;
+
+ALTER TABLE chopchop.product_catalog
+    ADD COLUMN IF NOT EXISTS pc_search tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('chopchop.catalan', pc_name), 'A') ||
+        setweight(to_tsvector('spanish', pc_name), 'A') ||
+        setweight(to_tsvector('chopchop.catalan', pc_description), 'B') ||
+        setweight(to_tsvector('spanish', pc_description), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS product_catalog_search_idx
+    ON chopchop.product_catalog USING gin (pc_search);
+CREATE INDEX IF NOT EXISTS product_catalog_name_trgm_idx
+    ON chopchop.product_catalog USING gin (pc_name gin_trgm_ops);
+
+
+-- Keep the description in sync from now on
+CREATE OR REPLACE FUNCTION chopchop.sync_verified_product_catalog() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM chopchop.product_catalog WHERE pc_id = OLD.vp_id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO chopchop.product_catalog (pc_id, pc_type, pc_name, pc_description, pc_image, pc_price, pc_category, pc_created_at)
+    SELECT NEW.vp_id, 'verified', NEW.vp_name, NEW.vp_description, NEW.vp_image, NEW.vp_price, NEW.vp_category::text, created_at
+    FROM chopchop.product_id
+    WHERE product_id = NEW.vp_id
+    ON CONFLICT (pc_id) DO UPDATE SET
+        pc_name = EXCLUDED.pc_name,
+        pc_description = EXCLUDED.pc_description,
+        pc_image = EXCLUDED.pc_image,
+        pc_price = EXCLUDED.pc_price,
+        pc_category = EXCLUDED.pc_category;
+
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION chopchop.sync_secondhand_product_catalog() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM chopchop.product_catalog WHERE pc_id = OLD.sp_id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO chopchop.product_catalog (pc_id, pc_type, pc_name, pc_description, pc_image, pc_price, pc_category, pc_created_at)
+    SELECT NEW.sp_id, 'secondhand', NEW.sp_name, NEW.sp_description, NEW.sp_image, NEW.sp_price, NEW.sp_category::text, created_at
+    FROM chopchop.product_id
+    WHERE product_id = NEW.sp_id
+    ON CONFLICT (pc_id) DO UPDATE SET
+        pc_name = EXCLUDED.pc_name,
+        pc_description = EXCLUDED.pc_description,
+        pc_image = EXCLUDED.pc_image,
+        pc_price = EXCLUDED.pc_price,
+        pc_category = EXCLUDED.pc_category;
+
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS verified_product_catalog ON chopchop.verified_product;
+CREATE TRIGGER verified_product_catalog
+    AFTER INSERT OR DELETE OR UPDATE OF vp_name, vp_description, vp_image, vp_price, vp_category
+    ON chopchop.verified_product
+    FOR EACH ROW EXECUTE FUNCTION chopchop.sync_verified_product_catalog();
+
+DROP TRIGGER IF EXISTS secondhand_product_catalog ON chopchop.secondhand_product;
+CREATE TRIGGER secondhand_product_catalog
+    AFTER INSERT OR DELETE OR UPDATE OF sp_name, sp_description, sp_image, sp_price, sp_category
+    ON chopchop.secondhand_product
+    FOR EACH ROW EXECUTE FUNCTION chopchop.sync_secondhand_product_catalog();
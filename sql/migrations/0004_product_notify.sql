@@ -0,0 +1,29 @@
+-- Notify the API workers of every change to a product so they can evict it
+-- from their caches. Notifications are only delivered once the transaction
+-- commits, the payload is the product id.
+CREATE OR REPLACE FUNCTION chopchop.notify_product_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    product record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        product := OLD;
+    ELSE
+        product := NEW;
+    END IF;
+
+    -- The id column is vp_id or sp_id depending on the table
+    PERFORM pg_notify('chopchop_product', to_jsonb(product) ->> TG_ARGV[0]);
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS verified_product_notify ON chopchop.verified_product;
+CREATE TRIGGER verified_product_notify
+    AFTER INSERT OR UPDATE OR DELETE ON chopchop.verified_product
+    FOR EACH ROW EXECUTE FUNCTION chopchop.notify_product_change('vp_id');
+
+DROP TRIGGER IF EXISTS secondhand_product_notify ON chopchop.secondhand_product;
+CREATE TRIGGER secondhand_product_notify
+    AFTER INSERT OR UPDATE OR DELETE ON chopchop.secondhand_product
+    FOR EACH ROW EXECUTE FUNCTION chopchop.notify_product_change('sp_id');
@@ -0,0 +1,16 @@
+-- Notify the API workers when the catalog listings change so they refresh
+-- their cached pages. Sent once per statement and without payload, Postgres
+-- folds identical notifications of a transaction into one, so bulk writes
+-- only send one. Stock changes don't touch the catalog and don't notify.
+CREATE OR REPLACE FUNCTION chopchop.notify_catalog_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('chopchop_catalog', '');
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS product_catalog_notify ON chopchop.product_catalog;
+CREATE TRIGGER product_catalog_notify
+    AFTER INSERT OR UPDATE OR DELETE ON chopchop.product_catalog
+    FOR EACH STATEMENT EXECUTE FUNCTION chopchop.notify_catalog_change();
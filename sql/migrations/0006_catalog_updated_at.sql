@@ -0,0 +1,66 @@
+-- Last change of each catalog entry, so exports can be synced incrementally
+-- with GET /products/export?since=. Existing entries take their creation time.
+-- Deleted products leave the catalog and aren't reported.
+ALTER TABLE chopchop.product_catalog
+    ADD COLUMN IF NOT EXISTS pc_updated_at timestamptz;
+
+UPDATE chopchop.product_catalog
+SET pc_updated_at = pc_created_at
+WHERE pc_updated_at IS NULL;
+
+ALTER TABLE chopchop.product_catalog
+    ALTER COLUMN pc_updated_at SET DEFAULT now(),
+    ALTER COLUMN pc_updated_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS product_catalog_updated_at_idx
+    ON chopchop.product_catalog (pc_updated_at, pc_id);
+
+
+-- New entries take the default, updates bump it
+CREATE OR REPLACE FUNCTION chopchop.sync_verified_product_catalog() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM chopchop.product_catalog WHERE pc_id = OLD.vp_id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO chopchop.product_catalog (pc_id, pc_type, pc_name, pc_description, pc_image, pc_price, pc_category, pc_created_at)
+    SELECT NEW.vp_id, 'verified', NEW.vp_name, NEW.vp_description, NEW.vp_image, NEW.vp_price, NEW.vp_category::text, created_at
+    FROM chopchop.product_id
+    WHERE product_id = NEW.vp_id
+    ON CONFLICT (pc_id) DO UPDATE SET
+        pc_name = EXCLUDED.pc_name,
+        pc_description = EXCLUDED.pc_description,
+        pc_image = EXCLUDED.pc_image,
+        pc_price = EXCLUDED.pc_price,
+        pc_category = EXCLUDED.pc_category,
+        pc_updated_at = now();
+
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION chopchop.sync_secondhand_product_catalog() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM chopchop.product_catalog WHERE pc_id = OLD.sp_id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO chopchop.product_catalog (pc_id, pc_type, pc_name, pc_description, pc_image, pc_price, pc_category, pc_created_at)
+    SELECT NEW.sp_id, 'secondhand', NEW.sp_name, NEW.sp_description, NEW.sp_image, NEW.sp_price, NEW.sp_category::text, created_at
+    FROM chopchop.product_id
+    WHERE product_id = NEW.sp_id
+    ON CONFLICT (pc_id) DO UPDATE SET
+        pc_name = EXCLUDED.pc_name,
+        pc_description = EXCLUDED.pc_description,
+        pc_image = EXCLUDED.pc_image,
+        pc_price = EXCLUDED.pc_price,
+        pc_category = EXCLUDED.pc_category,
+        pc_updated_at = now();
+
+    RETURN NEW;
+END
+$$;
@@ -0,0 +1,6 @@
+-- Purchase history of a user, newest first, for GET /purchases. The id breaks
+-- ties between purchases made at the same time, so keyset pagination is a
+-- single index range however many purchases the user has. The items of each
+-- purchase are found through the primary key of purchase_item.
+CREATE INDEX IF NOT EXISTS purchase_user_date_idx
+    ON chopchop.purchase (pu_user_id, pu_date, pu_id);
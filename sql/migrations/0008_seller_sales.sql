@@ -0,0 +1,105 @@
+-- Units sold and revenue per seller and day, and per seller, product and day,
+-- for GET /sales. They are kept up to date by a trigger on purchase_item, in
+-- the transaction of the purchase, so a year of history is at most 365 rows
+-- for the totals and one row per product and day with sales for the top
+-- products, instead of every purchase. Days are UTC. There is no foreign key
+-- to the products, the history of deleted products is kept.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS chopchop.seller_daily_sales (
+    sds_seller uuid NOT NULL,
+    sds_day date NOT NULL,
+    sds_product uuid NOT NULL,
+    sds_units bigint NOT NULL,
+    sds_revenue numeric NOT NULL,
+    PRIMARY KEY (sds_seller, sds_day, sds_product)
+);
+
+CREATE TABLE IF NOT EXISTS chopchop.seller_daily_totals (
+    sdt_seller uuid NOT NULL,
+    sdt_day date NOT NULL,
+    sdt_units bigint NOT NULL,
+    sdt_revenue numeric NOT NULL,
+    PRIMARY KEY (sdt_seller, sdt_day)
+);
+
+
+-- Statement level, so a purchase of several items is an upsert per table. Rows
+-- are grouped first, ON CONFLICT can't update the same row twice, and sorted
+-- so concurrent purchases update the shared rows in the same order
+CREATE OR REPLACE FUNCTION chopchop.add_seller_daily_sales() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO chopchop.seller_daily_sales (sds_seller, sds_day, sds_product, sds_units, sds_revenue)
+    SELECT
+        coalesce(vp_owner, sp_owner),
+        (pu_date AT TIME ZONE 'UTC')::date,
+        pi_product_id,
+        sum(pi_count),
+        sum(pi_paid)
+    FROM new_items
+    JOIN chopchop.purchase ON pu_id = pi_purchase_id
+    LEFT JOIN chopchop.verified_product ON vp_id = pi_product_id
+    LEFT JOIN chopchop.secondhand_product ON sp_id = pi_product_id
+    WHERE coalesce(vp_owner, sp_owner) IS NOT NULL
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (sds_seller, sds_day, sds_product) DO UPDATE SET
+        sds_units = chopchop.seller_daily_sales.sds_units + EXCLUDED.sds_units,
+        sds_revenue = chopchop.seller_daily_sales.sds_revenue + EXCLUDED.sds_revenue;
+
+    INSERT INTO chopchop.seller_daily_totals (sdt_seller, sdt_day, sdt_units, sdt_revenue)
+    SELECT
+        coalesce(vp_owner, sp_owner),
+        (pu_date AT TIME ZONE 'UTC')::date,
+        sum(pi_count),
+        sum(pi_paid)
+    FROM new_items
+    JOIN chopchop.purchase ON pu_id = pi_purchase_id
+    LEFT JOIN chopchop.verified_product ON vp_id = pi_product_id
+    LEFT JOIN chopchop.secondhand_product ON sp_id = pi_product_id
+    WHERE coalesce(vp_owner, sp_owner) IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (sdt_seller, sdt_day) DO UPDATE SET
+        sdt_units = chopchop.seller_daily_totals.sdt_units + EXCLUDED.sdt_units,
+        sdt_revenue = chopchop.seller_daily_totals.sdt_revenue + EXCLUDED.sdt_revenue;
+
+    RETURN NULL;
+END
+$$;
+
+-- Purchases are final, items are never updated or deleted
+DROP TRIGGER IF EXISTS purchase_item_seller_sales ON chopchop.purchase_item;
+CREATE TRIGGER purchase_item_seller_sales
+    AFTER INSERT ON chopchop.purchase_item
+    REFERENCING NEW TABLE AS new_items
+    FOR EACH STATEMENT EXECUTE FUNCTION chopchop.add_seller_daily_sales();
+
+
+-- Backfill the purchases made before the rollup. The lock keeps purchases
+-- from being counted twice, or missed, while it runs
+LOCK TABLE chopchop.purchase_item IN SHARE MODE;
+
+TRUNCATE chopchop.seller_daily_sales, chopchop.seller_daily_totals;
+
+INSERT INTO chopchop.seller_daily_sales (sds_seller, sds_day, sds_product, sds_units, sds_revenue)
+SELECT
+    coalesce(vp_owner, sp_owner),
+    (pu_date AT TIME ZONE 'UTC')::date,
+    pi_product_id,
+    sum(pi_count),
+    sum(pi_paid)
+FROM chopchop.purchase_item
+JOIN chopchop.purchase ON pu_id = pi_purchase_id
+LEFT JOIN chopchop.verified_product ON vp_id = pi_product_id
+LEFT JOIN chopchop.secondhand_product ON sp_id = pi_product_id
+WHERE coalesce(vp_owner, sp_owner) IS NOT NULL
+GROUP BY 1, 2, 3;
+
+INSERT INTO chopchop.seller_daily_totals (sdt_seller, sdt_day, sdt_units, sdt_revenue)
+SELECT sds_seller, sds_day, sum(sds_units), sum(sds_revenue)
+FROM chopchop.seller_daily_sales
+GROUP BY 1, 2;
+
+COMMIT;
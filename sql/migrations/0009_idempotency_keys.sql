@@ -0,0 +1,17 @@
+-- Responses of the requests sent with an Idempotency-Key header, replayed
+-- when a client retries them. A key is claimed in the transaction of the
+-- request it belongs to, so it is only stored if the request succeeds and a
+-- concurrent duplicate waits on the row lock until the first one finishes.
+CREATE TABLE IF NOT EXISTS chopchop.idempotency_key (
+    ik_user uuid NOT NULL,
+    ik_key text NOT NULL,
+    ik_endpoint text NOT NULL,
+    ik_fingerprint text NOT NULL,
+    ik_response jsonb,
+    ik_created_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (ik_user, ik_key)
+);
+
+-- Expired keys are deleted in batches by the API
+CREATE INDEX IF NOT EXISTS idempotency_key_created_at_idx
+    ON chopchop.idempotency_key (ik_created_at);
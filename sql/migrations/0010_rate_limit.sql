@@ -0,0 +1,8 @@
+-- Token buckets shared by the workers when RATE_LIMIT_BACKEND=postgres. Losing
+-- them in a crash only refills every bucket, so the table isn't WAL-logged.
+-- Buckets untouched for an hour are full and are deleted by the API.
+CREATE UNLOGGED TABLE IF NOT EXISTS chopchop.rate_limit_bucket (
+    rl_key text PRIMARY KEY,
+    rl_tokens float8 NOT NULL,
+    rl_updated_at timestamptz NOT NULL
+);
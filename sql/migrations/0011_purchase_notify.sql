@@ -0,0 +1,18 @@
+-- Notify the API workers of the users that made a purchase, so every worker
+-- reads their purchases from the primary until the replicas have them, not
+-- only the one that served the purchase. Sent once per statement and user,
+-- the payload is the user id.
+CREATE OR REPLACE FUNCTION chopchop.notify_purchase() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('chopchop_user', user_id::text)
+    FROM (SELECT DISTINCT pu_user_id AS user_id FROM new_purchases) AS users;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS purchase_notify ON chopchop.purchase;
+CREATE TRIGGER purchase_notify
+    AFTER INSERT ON chopchop.purchase
+    REFERENCING NEW TABLE AS new_purchases
+    FOR EACH STATEMENT EXECUTE FUNCTION chopchop.notify_purchase();
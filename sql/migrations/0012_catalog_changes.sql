@@ -0,0 +1,58 @@
+-- Incremental exports can't rely on pc_updated_at: now() is the start of the
+-- writing transaction, which may commit after an export that already read
+-- later times. Each entry now records the id of the transaction that last
+-- changed it, and an export returns the oldest transaction still running
+-- when it started, pg_snapshot_xmin(). Everything before it is committed and
+-- was exported, the next export asks for the changes from there on, so a
+-- slow transaction is exported late rather than never.
+ALTER TABLE chopchop.product_catalog
+    ADD COLUMN IF NOT EXISTS pc_change xid8 NOT NULL DEFAULT '0';
+
+ALTER TABLE chopchop.product_catalog
+    ALTER COLUMN pc_change DROP DEFAULT;
+
+CREATE OR REPLACE FUNCTION chopchop.stamp_catalog_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.pc_change := pg_current_xact_id();
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS product_catalog_change ON chopchop.product_catalog;
+CREATE TRIGGER product_catalog_change
+    BEFORE INSERT OR UPDATE ON chopchop.product_catalog
+    FOR EACH ROW EXECUTE FUNCTION chopchop.stamp_catalog_change();
+
+CREATE INDEX IF NOT EXISTS product_catalog_change_idx
+    ON chopchop.product_catalog (pc_change, pc_id);
+
+DROP INDEX IF EXISTS chopchop.product_catalog_updated_at_idx;
+
+
+-- Deleted entries, exported as tombstones so synced copies drop them. Ids are
+-- never reused.
+CREATE TABLE IF NOT EXISTS chopchop.product_catalog_deleted (
+    pcd_id uuid PRIMARY KEY,
+    pcd_change xid8 NOT NULL,
+    pcd_deleted_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS product_catalog_deleted_change_idx
+    ON chopchop.product_catalog_deleted (pcd_change, pcd_id);
+
+CREATE OR REPLACE FUNCTION chopchop.record_catalog_delete() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO chopchop.product_catalog_deleted (pcd_id, pcd_change)
+    SELECT pc_id, pg_current_xact_id() FROM deleted_entries
+    ON CONFLICT (pcd_id) DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS product_catalog_delete ON chopchop.product_catalog;
+CREATE TRIGGER product_catalog_delete
+    AFTER DELETE ON chopchop.product_catalog
+    REFERENCING OLD TABLE AS deleted_entries
+    FOR EACH STATEMENT EXECUTE FUNCTION chopchop.record_catalog_delete();
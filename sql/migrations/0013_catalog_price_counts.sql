@@ -0,0 +1,139 @@
+-- Catalog entries per category and price bucket, and per category and price,
+-- for the facets of GET /products without search terms. The histogram and the
+-- whole buckets inside a price filter are summed from the bucket counts, only
+-- the prices of the buckets cut by the filter are read from the price counts.
+-- Kept up to date by statement-level triggers on the catalog: a statement
+-- upserts each count it changed once, in key order, so concurrent writes take
+-- the row locks in the same order. Edits that keep the category and price,
+-- and stock changes, don't touch them.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS chopchop.catalog_price_count (
+    cpc_category text NOT NULL,
+    cpc_price numeric NOT NULL,
+    cpc_count bigint NOT NULL,
+    PRIMARY KEY (cpc_category, cpc_price)
+);
+
+CREATE INDEX IF NOT EXISTS catalog_price_count_price_idx
+    ON chopchop.catalog_price_count (cpc_price) INCLUDE (cpc_category, cpc_count);
+
+CREATE TABLE IF NOT EXISTS chopchop.catalog_bucket_count (
+    cbc_category text NOT NULL,
+    cbc_min numeric NOT NULL,
+    cbc_count bigint NOT NULL,
+    PRIMARY KEY (cbc_category, cbc_min)
+);
+
+-- Lower bound of the histogram bucket of a price, -Infinity below the first.
+-- Must match PRICE_BUCKETS in src/model/product/product.py
+CREATE OR REPLACE FUNCTION chopchop.price_bucket(price numeric) RETURNS numeric
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT coalesce(
+        (ARRAY[0, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]::numeric[])[
+            width_bucket(price, ARRAY[0, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]::numeric[])],
+        '-Infinity')
+$$;
+
+CREATE OR REPLACE FUNCTION chopchop.add_catalog_price_counts(
+    categories text[], prices numeric[], deltas bigint[]
+) RETURNS void
+LANGUAGE sql AS $$
+    WITH changes AS (
+        SELECT category, price, sum(delta) AS delta
+        FROM unnest(categories, prices, deltas) AS changes (category, price, delta)
+        GROUP BY 1, 2
+        HAVING sum(delta) <> 0
+    ), price_counts AS (
+        INSERT INTO chopchop.catalog_price_count AS counts (cpc_category, cpc_price, cpc_count)
+        SELECT category, price, delta
+        FROM changes
+        ORDER BY 1, 2
+        ON CONFLICT (cpc_category, cpc_price) DO UPDATE SET
+            cpc_count = counts.cpc_count + EXCLUDED.cpc_count
+    )
+    INSERT INTO chopchop.catalog_bucket_count AS counts (cbc_category, cbc_min, cbc_count)
+    SELECT category, chopchop.price_bucket(price), sum(delta)
+    FROM changes
+    GROUP BY 1, 2
+    HAVING sum(delta) <> 0
+    ORDER BY 1, 2
+    ON CONFLICT (cbc_category, cbc_min) DO UPDATE SET
+        cbc_count = counts.cbc_count + EXCLUDED.cbc_count
+$$;
+
+-- Transition tables only exist for the operation that fired the trigger, so
+-- each operation has its own function
+CREATE OR REPLACE FUNCTION chopchop.count_inserted_catalog_prices() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM chopchop.add_catalog_price_counts(
+        array_agg(pc_category), array_agg(pc_price), array_agg(1::bigint))
+    FROM new_entries;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION chopchop.count_updated_catalog_prices() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM chopchop.add_catalog_price_counts(
+        array_agg(pc_category), array_agg(pc_price), array_agg(delta))
+    FROM (
+        SELECT pc_category, pc_price, 1::bigint AS delta FROM new_entries
+        UNION ALL
+        SELECT pc_category, pc_price, -1 FROM old_entries
+    ) AS changes;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION chopchop.count_deleted_catalog_prices() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM chopchop.add_catalog_price_counts(
+        array_agg(pc_category), array_agg(pc_price), array_agg(-1::bigint))
+    FROM old_entries;
+
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS product_catalog_count_inserts ON chopchop.product_catalog;
+CREATE TRIGGER product_catalog_count_inserts
+    AFTER INSERT ON chopchop.product_catalog
+    REFERENCING NEW TABLE AS new_entries
+    FOR EACH STATEMENT EXECUTE FUNCTION chopchop.count_inserted_catalog_prices();
+
+DROP TRIGGER IF EXISTS product_catalog_count_updates ON chopchop.product_catalog;
+CREATE TRIGGER product_catalog_count_updates
+    AFTER UPDATE ON chopchop.product_catalog
+    REFERENCING OLD TABLE AS old_entries NEW TABLE AS new_entries
+    FOR EACH STATEMENT EXECUTE FUNCTION chopchop.count_updated_catalog_prices();
+
+DROP TRIGGER IF EXISTS product_catalog_count_deletes ON chopchop.product_catalog;
+CREATE TRIGGER product_catalog_count_deletes
+    AFTER DELETE ON chopchop.product_catalog
+    REFERENCING OLD TABLE AS old_entries
+    FOR EACH STATEMENT EXECUTE FUNCTION chopchop.count_deleted_catalog_prices();
+
+
+-- Count the entries made before the triggers. The lock keeps entries from
+-- being counted twice, or missed, while it runs
+LOCK TABLE chopchop.product_catalog IN SHARE MODE;
+
+TRUNCATE chopchop.catalog_price_count, chopchop.catalog_bucket_count;
+
+INSERT INTO chopchop.catalog_price_count (cpc_category, cpc_price, cpc_count)
+SELECT pc_category, pc_price, count(*)
+FROM chopchop.product_catalog
+GROUP BY 1, 2;
+
+INSERT INTO chopchop.catalog_bucket_count (cbc_category, cbc_min, cbc_count)
+SELECT cpc_category, chopchop.price_bucket(cpc_price), sum(cpc_count)
+FROM chopchop.catalog_price_count
+GROUP BY 1, 2;
+
+COMMIT;
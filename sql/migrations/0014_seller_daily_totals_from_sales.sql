@@ -0,0 +1,35 @@
+-- Drop seller_daily_totals. Every purchase of a seller upserted the same row
+-- for the day, so their checkouts waited on each other until commit. The
+-- totals are summed from seller_daily_sales instead, whose rows are per
+-- product, so only purchases of the same product share one. pi_paid is what
+-- was paid for the whole item, count included, and is summed as is.
+BEGIN;
+
+CREATE OR REPLACE FUNCTION chopchop.add_seller_daily_sales() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO chopchop.seller_daily_sales (sds_seller, sds_day, sds_product, sds_units, sds_revenue)
+    SELECT
+        coalesce(vp_owner, sp_owner),
+        (pu_date AT TIME ZONE 'UTC')::date,
+        pi_product_id,
+        sum(pi_count),
+        sum(pi_paid)
+    FROM new_items
+    JOIN chopchop.purchase ON pu_id = pi_purchase_id
+    LEFT JOIN chopchop.verified_product ON vp_id = pi_product_id
+    LEFT JOIN chopchop.secondhand_product ON sp_id = pi_product_id
+    WHERE coalesce(vp_owner, sp_owner) IS NOT NULL
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (sds_seller, sds_day, sds_product) DO UPDATE SET
+        sds_units = chopchop.seller_daily_sales.sds_units + EXCLUDED.sds_units,
+        sds_revenue = chopchop.seller_daily_sales.sds_revenue + EXCLUDED.sds_revenue;
+
+    RETURN NULL;
+END
+$$;
+
+DROP TABLE IF EXISTS chopchop.seller_daily_totals;
+
+COMMIT;
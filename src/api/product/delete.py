@@ -6,28 +6,24 @@ from auth import authenticate
 from database import get_db_connection
 from model.user import User
 from model.product.product import Product
+from profiling import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.delete("/product/{product_id}", description="Delete a product")
 async def delete_product(product_id: UUID, user: User = Depends(authenticate)):
     try:
-        conn = get_db_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                product = Product.factory(cursor, product_id)
-                product.delete(cursor, user)
-
-                # If it wasn't a SecondHandProduct either, it's either not an existing product or the user doesn't have permission to delete it. Return an error.
-                if not product:
-                    raise HTTPException(
-                        status_code=404, detail="Product not found")
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                # Raises a 404 if the product doesn't exist or the user doesn't have permission to delete it
+                product = await Product.factory(cursor, product_id)
+                await product.delete(cursor, user)
 
         return Response(status_code=200)
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        conn.close()
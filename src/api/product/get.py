@@ -2,10 +2,10 @@ from uuid import UUID
 
 from fastapi import APIRouter, HTTPException
 
-from database import get_db_connection
 from model.product.product import Product
+from profiling import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.get(
@@ -14,15 +14,10 @@ router = APIRouter()
 )
 async def get_product(product_id: UUID):
     try:
-        conn = get_db_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                product = Product.factory(cursor, product_id)
-                product.fetch(cursor, product_id)
-                return product
+        return await Product.fetch(product_id)
+
+    except HTTPException:
+        raise
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        conn.close()
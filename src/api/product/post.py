@@ -1,38 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 
 from auth import authenticate
 from database import get_db_connection
+from idempotency import run_once
 from model.product.product import NewProduct
 from model.user import User
+from profiling import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.post(
     "/product",
-    description="Create a new product",
+    description="Create a new product. Retries with the same Idempotency-Key get the response of the first request",
 )
-async def post_product(product: NewProduct, user: User = Depends(authenticate)):
+async def post_product(
+    product: NewProduct,
+    response: Response,
+    user: User = Depends(authenticate),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
     try:
-        conn = get_db_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                conn.autocommit = (
-                    False  # Utilitzar una transacció ja que hi ha 2 insercions
-                )
-
-                try:
-                    product = product.into_product()
-                    product_id = product.insert(cursor, user)
-                    conn.commit()  # Cometre la transacció si tot ha anat bé
+        async def insert(cursor):
+            return await product.factory().insert(cursor, user)
+
+        if idempotency_key is not None:
+            product_id, replayed = await run_once(user, idempotency_key, "POST /product", product, insert)
+            if replayed:
+                response.headers["Idempotent-Replayed"] = "true"
+            return product_id
+
+        async with get_db_connection() as conn:
+            # Utilitzar una transacció ja que hi ha 2 insercions, es fa rollback si cap inserció falla
+            async with conn.transaction():
+                async with conn.cursor() as cursor:
+                    product_id = await insert(cursor)
                     return product_id
 
-                except Exception as e:
-                    conn.rollback()  # Fer rollback si cap inserció falla
-                    raise HTTPException(status_code=500, detail=str(e))
+    except HTTPException:
+        raise
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        conn.close()
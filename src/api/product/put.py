@@ -1,33 +1,39 @@
+from uuid import UUID
+
 from fastapi import APIRouter, Depends, HTTPException
 
 from auth import authenticate
 from database import get_db_connection
 from model.user import User
-from model.product.product import NewProduct
+from model.product.product import NewProduct, Product
+from profiling import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.put(
-    "/product",
-    description="Create a new product",
+    "/product/{product_id}",
+    description="Update an existing product",
 )
-async def post_product(product: NewProduct, user: User = Depends(authenticate)):
+async def put_product(
+    product_id: UUID, product: NewProduct, user: User = Depends(authenticate)
+):
     try:
-        conn = get_db_connection()
-        with conn:
-            with conn.cursor() as cursor:
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                current = await Product.factory(cursor, product_id)
+
+                product = product.factory()
+                if type(product) is not type(current):
+                    raise HTTPException(
+                        status_code=400, detail="The product type can't be changed")
 
-                try:
-                    product = product.into_product()
-                    product_id = product.update(cursor, user)
-                    return product_id
+                product.id = current.id
+                await product.update(cursor, user)
+                return product_id
 
-                except Exception as e:
-                    raise HTTPException(status_code=500, detail=str(e))
+    except HTTPException:
+        raise
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        conn.close()
@@ -1,34 +1,104 @@
-from typing import Optional
-
-from fastapi import APIRouter, HTTPException, Query
-
-from database import get_db_connection
-from model.product.product import Product
-
-router = APIRouter()
-
-
-@router.get(
-    "/products",
-    description="Get basic information of all products",
-)
-async def get_products(
-    query: Optional[str] = Query(None),
-    page: Optional[int] = Query(0),
-    category: Optional[Product.Category] = Query(None),
-    min_price: Optional[float] = Query(0.0),
-    max_price: Optional[float] = Query(float("inf")),
-):
-    try:
-        conn = get_db_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                return Product.get_products(
-                    cursor, query, page, category, min_price, max_price
-                )
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        conn.close()
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+
+from model.product.export import ExportFormat, export_products
+from model.product.listing import get_facets, get_listing
+from model.product.product import Product
+from profiling import ProfiledRoute
+
+router = APIRouter(route_class=ProfiledRoute)
+
+
+@router.get(
+    "/products",
+    description="Get basic information of all products. The cursor of the next page, if any, is in the X-Next-Cursor header",
+)
+async def get_products(
+    response: Response,
+    query: Optional[str] = Query(
+        None, description="Search terms, matched against the name and description"),
+    page: Optional[int] = Query(0),
+    category: Optional[Product.Category] = Query(None),
+    min_price: Optional[float] = Query(0.0),
+    max_price: Optional[float] = Query(float("inf")),
+    sort: Optional[Product.Sort] = Query(
+        None, description="Defaults to relevance when searching and newest otherwise"),
+    cursor: Optional[str] = Query(
+        None, description="X-Next-Cursor of the previous page, takes precedence over page"),
+    facets: bool = Query(
+        False, description="Return an object with the products, their next_cursor and the facets: the total, the count per category "
+        "and a price histogram of the matches. Category counts ignore the category filter and the histogram ignores the price filter"),
+):
+    try:
+        if not facets:
+            listing = await get_listing(
+                query, page, category, min_price, max_price, sort, cursor
+            )
+            listing_facets = None
+
+        else:
+            # One after the other, so a request holds one connection at a time
+            listing = await get_listing(
+                query, page, category, min_price, max_price, sort, cursor
+            )
+            listing_facets = await get_facets(query, category, min_price, max_price)
+
+        if listing["next_cursor"] is not None:
+            response.headers["X-Next-Cursor"] = listing["next_cursor"]
+
+        # The body stays the array of products clients expect, unless they
+        # ask for the facets
+        if listing_facets is None:
+            return listing["products"]
+
+        return {**listing, "facets": listing_facets}
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get(
+    "/products/export",
+    description="Stream the whole catalog as NDJSON or CSV, or the changes and deletions since a previous export. "
+    "The X-Export-Since header is the since of the next incremental export",
+)
+async def get_products_export(
+    format: ExportFormat = Query(ExportFormat.NDJSON),
+    since: Optional[int] = Query(
+        None, ge=0, description="X-Export-Since of a previous export, only send what changed since then"),
+):
+    try:
+        stream = export_products(format, since)
+        next_since = await anext(stream)
+        # Start the query before answering, so failures still get a status code
+        first = await anext(stream)
+
+        async def body():
+            try:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+
+            finally:
+                # Closes the connection as soon as the client goes away
+                await stream.aclose()
+
+        return StreamingResponse(
+            body(),
+            media_type=format.media_type,
+            headers={
+                "Content-Disposition": f"attachment; filename=products.{format.value}",
+                "X-Export-Since": str(next_since),
+            },
+        )
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
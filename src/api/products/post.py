@@ -0,0 +1,76 @@
+import os
+from typing import List
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+
+from auth import authenticate
+from model.product.bulk import import_products, read_csv, read_ndjson
+from model.product.product import Product
+from model.user import User
+from profiling import ProfiledRoute
+
+# Largest number of ids accepted by POST /products/batch
+PRODUCT_BATCH_SIZE = int(os.getenv("PRODUCT_BATCH_SIZE", "500"))
+
+router = APIRouter(route_class=ProfiledRoute)
+
+
+@router.post(
+    "/products/batch",
+    description="Get detailed information of several products, ids that don't exist are returned in missing",
+)
+async def post_products_batch(product_ids: List[UUID]):
+    try:
+        # Repeated ids are returned once
+        product_ids = list(dict.fromkeys(product_ids))
+
+        if len(product_ids) > PRODUCT_BATCH_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {PRODUCT_BATCH_SIZE} products can be requested at once",
+            )
+
+        return await Product.fetch_many(product_ids)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post(
+    "/products/import",
+    description="Import verified products from a CSV (text/csv) or NDJSON (application/x-ndjson) upload. "
+    "Each row has the fields of POST /product, the type can be omitted",
+)
+async def post_products_import(
+    request: Request,
+    skip: int = Query(
+        0, ge=0, description="Rows to skip, committed of an import that stopped to resume it"),
+    atomic: bool = Query(
+        False, description="Import every row in one transaction, or nothing if any row is invalid"),
+    user: User = Depends(authenticate),
+):
+    try:
+        content_type = request.headers.get(
+            "content-type", "").split(";")[0].strip()
+        match content_type:
+            case "text/csv":
+                rows = read_csv(request.stream())
+
+            case "application/x-ndjson" | "application/jsonl":
+                rows = read_ndjson(request.stream())
+
+            case _:
+                raise HTTPException(
+                    status_code=415, detail="Upload text/csv or application/x-ndjson")
+
+        return await import_products(user, rows, skip, atomic)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -3,11 +3,12 @@ from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException
 
 from auth import authenticate
-from database import get_db_connection
+from database import get_read_connection
 from model.purchase import Purchase
 from model.user import User
+from profiling import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.get(
@@ -16,13 +17,12 @@ router = APIRouter()
 )
 async def get_products(purchase_id: UUID, user: User = Depends(authenticate)):
     try:
-        conn = get_db_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                return Purchase(user).fetch(cursor, purchase_id)
+        async with get_read_connection(("user", user.id)) as conn:
+            async with conn.cursor() as cursor:
+                return await Purchase(user).fetch(cursor, purchase_id)
+
+    except HTTPException:
+        raise
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        conn.close()
@@ -1,42 +1,46 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 
 from auth import authenticate
 from database import get_db_connection
+from idempotency import run_once
 from model.purchase import Purchase
 from model.user import User
+from profiling import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.post(
     "/purchase",
-    description="Make a purchase",
+    description="Make a purchase. Retries with the same Idempotency-Key get the response of the first request",
 )
 async def post_product(
-    items: List[Purchase.PurchaseItem], user: User = Depends(authenticate)
+    items: List[Purchase.PurchaseItem],
+    response: Response,
+    user: User = Depends(authenticate),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
 ):
     try:
-        conn = get_db_connection()
-        with conn:
-            with conn.cursor() as cursor:
-                conn.autocommit = (
-                    False  # We have to insert several tables, so use a transaction
-                )
-
-                try:
-                    purchase_id = Purchase(user).insert(cursor, items)
-                    conn.commit()  # Commit the transaction if all is well
-
+        async def insert(cursor):
+            return await Purchase(user).insert(cursor, items)
+
+        if idempotency_key is not None:
+            purchase_id, replayed = await run_once(user, idempotency_key, "POST /purchase", items, insert)
+            if replayed:
+                response.headers["Idempotent-Replayed"] = "true"
+            return purchase_id
+
+        async with get_db_connection() as conn:
+            # We have to insert several tables, so use a transaction
+            async with conn.transaction():
+                async with conn.cursor() as cursor:
+                    purchase_id = await insert(cursor)
                     return purchase_id
 
-                except Exception as e:
-                    conn.rollback()
-                    raise HTTPException(status_code=500, detail=str(e))
+    except HTTPException:
+        raise
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        conn.close()
@@ -0,0 +1,33 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from auth import authenticate
+from database import get_read_connection
+from model.purchase import Purchase
+from model.user import User
+from profiling import ProfiledRoute
+
+router = APIRouter(route_class=ProfiledRoute)
+
+
+@router.get(
+    "/purchases",
+    description="Retrieve the purchases of the user, newest first, with their items and a summary of each product",
+)
+async def get_purchases(
+    limit: int = Query(20, ge=1, le=100, description="Purchases per page"),
+    cursor: Optional[str] = Query(
+        None, description="next_cursor of the previous page"),
+    user: User = Depends(authenticate),
+):
+    try:
+        async with get_read_connection(("user", user.id)) as conn:
+            async with conn.cursor() as db_cursor:
+                return await Purchase(user).history(db_cursor, limit, cursor)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,41 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from auth import authenticate
+from database import get_read_connection
+from model.sales import Sales
+from model.user import User
+from profiling import ProfiledRoute
+
+router = APIRouter(route_class=ProfiledRoute)
+
+
+@router.get(
+    "/sales",
+    description="Revenue and units sold by the user's products over time, and the top selling products",
+)
+async def get_sales(
+    start: Optional[date] = Query(
+        None, description="First day of the period, defaults to a year before the end"),
+    end: Optional[date] = Query(
+        None, description="Last day of the period, defaults to today (UTC)"),
+    granularity: Sales.Granularity = Query(Sales.Granularity.DAY),
+    top: int = Query(10, ge=0, le=100,
+                     description="Number of top selling products, by revenue"),
+    user: User = Depends(authenticate),
+):
+    try:
+        end = end or datetime.now(timezone.utc).date()
+        start = start or end - timedelta(days=365)
+
+        async with get_read_connection(("user", user.id)) as conn:
+            async with conn.cursor() as cursor:
+                return await Sales.get_report(cursor, user, start, end, granularity, top)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
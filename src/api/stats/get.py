@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from auth import authenticate, token_cache
+from database import pool_stats, replica_stats
+from idempotency import idempotency_cache, idempotency_flight
+from model.product.listing import listing_cache, listing_flight
+from model.product.product import product_cache, product_flight
+from model.user import Admin, User
+from profiling import ProfiledRoute
+from ratelimit import buckets
+
+
+# The stats describe the deployment, replica addresses included
+def authenticate_admin(user: User = Depends(authenticate)):
+    if not isinstance(user, Admin):
+        raise HTTPException(
+            status_code=403, detail="Only admins can read the stats")
+    return user
+
+
+router = APIRouter(route_class=ProfiledRoute,
+                   dependencies=[Depends(authenticate_admin)])
+
+
+@router.get(
+    "/stats/database",
+    description="Connection pool usage, used to size the pools, and the lag of each read replica",
+)
+async def get_database_stats():
+    return {**pool_stats(), "replicas": replica_stats()}
+
+
+@router.get(
+    "/stats/auth",
+    description="Hit rate of the verified token cache",
+)
+async def get_auth_stats():
+    return token_cache.stats()
+
+
+@router.get(
+    "/stats/product",
+    description="Hit rate of the product detail cache",
+)
+async def get_product_stats():
+    return {**product_cache.stats(), "coalescing": product_flight.stats()}
+
+
+@router.get(
+    "/stats/listing",
+    description="Hit rate of the product listing cache",
+)
+async def get_listing_stats():
+    return {**listing_cache.stats(), "coalescing": listing_flight.stats()}
+
+
+@router.get(
+    "/stats/idempotency",
+    description="Hit rate of the recent idempotency keys cache",
+)
+async def get_idempotency_stats():
+    return {**idempotency_cache.stats(), "coalescing": idempotency_flight.stats()}
+
+
+@router.get(
+    "/stats/ratelimit",
+    description="Token buckets of the rate limiter",
+)
+async def get_ratelimit_stats():
+    return buckets.stats()
@@ -1,10 +1,14 @@
+import hmac
 import os
+import time
 from uuid import UUID
 
 import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
+import profiling
+from cache import TTLCache
 from model.user import User, Particular, Professional, Enterprise, Admin
 
 SECRET_KEY = os.getenv("SECRET_KEY", "Secret key missing!!")
@@ -12,45 +16,44 @@ ALGORITHM = "HS256"
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Verified tokens and the user built from them. Entries never outlive the
+# token's own expiration
+token_cache = TTLCache(
+    max_size=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "300")),  # seconds
+)
+
+
+def token_digest(token: str):
+    # Keyed with the secret, entries verified with a previous key are never
+    # found again once it rotates. Raw tokens are never kept in memory
+    return hmac.digest(SECRET_KEY.encode(), token.encode(), "sha256")
+
 
 def verify_jwt_token(token: str):
+    key = token_digest(token)
+
+    user = token_cache.get(key)
+    if user is not None:
+        return user
+
+    user, expiration = decode_jwt_token(token)
+
+    if user is not None:
+        ttl = None if expiration is None else expiration - time.time()
+        token_cache.set(key, user, ttl)
+
+    return user
+
+
+def decode_jwt_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        return build_user(payload), payload.get("exp")
 
-        type_ = User.Type(payload.get("type"))
-
-        match type_:
-            case User.Type.PARTICULAR:
-                return Particular(
-                    id=UUID(payload.get("sub")),
-                    name=payload.get("name"),
-                    surname=payload.get("surname"),
-                )
-
-            case User.Type.PROFESSIONAL:
-                return Professional(
-                    id=UUID(payload.get("sub")),
-                    name=payload.get("name"),
-                    surname=payload.get("surname"),
-                    nif=payload.get("nif"),
-                )
-
-            case User.Type.ENTERPRISE:
-                return Enterprise(
-                    id=UUID(payload.get("sub")),
-                    name=payload.get("name"),
-                    surname=payload.get("surname"),
-                    nif=payload.get("nif"),
-                )
-
-            case User.Type.ADMIN:
-                return Admin(
-                    id=UUID(payload.get("sub")),
-                    name=payload.get("name"),
-                    surname=payload.get("surname"),
-                )
-
-    except jwt.PyJWTError:
+    # Signed tokens with an unknown type or without a valid subject are as
+    # unusable as badly signed ones
+    except (jwt.PyJWTError, ValueError, TypeError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authorization token could not be validated",
@@ -58,5 +61,41 @@ def verify_jwt_token(token: str):
         )
 
 
+def build_user(payload: dict):
+    type_ = User.Type(payload.get("type"))
+
+    match type_:
+        case User.Type.PARTICULAR:
+            return Particular(
+                id=UUID(payload.get("sub")),
+                name=payload.get("name"),
+                surname=payload.get("surname"),
+            )
+
+        case User.Type.PROFESSIONAL:
+            return Professional(
+                id=UUID(payload.get("sub")),
+                name=payload.get("name"),
+                surname=payload.get("surname"),
+                nif=payload.get("nif"),
+            )
+
+        case User.Type.ENTERPRISE:
+            return Enterprise(
+                id=UUID(payload.get("sub")),
+                name=payload.get("name"),
+                surname=payload.get("surname"),
+                nif=payload.get("nif"),
+            )
+
+        case User.Type.ADMIN:
+            return Admin(
+                id=UUID(payload.get("sub")),
+                name=payload.get("name"),
+                surname=payload.get("surname"),
+            )
+
+
 def authenticate(token: str = Depends(oauth2_scheme)):
-    return verify_jwt_token(token)
+    with profiling.span("auth"):
+        return verify_jwt_token(token)
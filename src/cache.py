@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Bounded least recently used cache whose entries expire after a time to
+    live. Sync dependencies run in FastAPI's threadpool, so access is guarded
+    by a lock that is only held for the dictionary operations.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, `ttl` can only shorten the cache's time to live"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class RefreshingCache:
+    """
+    Cache of values produced by async loaders. Entries are fresh for `ttl`
+    seconds and are then served stale for up to `stale_ttl` more seconds while
+    a single background task reloads them, so callers never wait on a refresh.
+    """
+
+    def __init__(self, max_size: int, ttl: float, stale_ttl: float):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+        # Entries are (generation, fresh until, value). expire() bumps the
+        # generation to turn every entry stale at once, clear() also discards
+        # the values that were being loaded before it was called
+        self._entries = TTLCache(max_size, math.inf)
+        self._generation = 0
+        self._cleared_generation = 0
+        self._refreshing: dict[Hashable, asyncio.Task] = {}
+
+        self.stale_hits = 0
+        self.refresh_errors = 0
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[0] >= self._cleared_generation:
+            generation, fresh_until, value = entry
+            if generation == self._generation and fresh_until > time.monotonic():
+                return value
+
+            self.stale_hits += 1
+            self._refresh_in_background(key, loader)
+            return value
+
+        generation = self._generation
+        value = await loader()
+        self._store(key, value, generation)
+        return value
+
+    def _store(self, key: Hashable, value: Any, generation: int):
+        # A value loaded before the last expire() is stored already stale
+        self._entries.set(
+            key,
+            (generation, time.monotonic() + self.ttl, value),
+            self.ttl + self.stale_ttl,
+        )
+
+    def expire(self):
+        """Mark every entry as stale, or drop them when stale entries are disabled"""
+        if self.stale_ttl > 0:
+            self._generation += 1
+        else:
+            self.clear()
+
+    def clear(self):
+        self._generation += 1
+        self._cleared_generation = self._generation
+        self._entries.clear()
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing:
+            return
+
+        generation = self._generation
+
+        async def refresh():
+            try:
+                self._store(key, await loader(), generation)
+
+            except Exception as e:
+                # Keep serving the stale value, the next read retries
+                self.refresh_errors += 1
+                logger.warning("Cache refresh failed: %s", e)
+
+            finally:
+                del self._refreshing[key]
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    def stats(self):
+        return {
+            **self._entries.stats(),
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "stale_hits": self.stale_hits,
+            "refreshing": len(self._refreshing),
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+class SingleFlight:
+    """
+    Runs concurrent calls that share a key once and hands the result, or the
+    exception, to every caller. A caller stops waiting after its timeout, the
+    shared call keeps running for the others.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+        self.calls = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+    ) -> Any:
+        call = self._calls.get(key)
+
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._forget(key, call))
+            self.calls += 1
+
+        else:
+            self.shared += 1
+
+        try:
+            # Shielded so a caller that is cancelled or times out doesn't cancel the call for everyone
+            return await asyncio.wait_for(
+                asyncio.shield(call), self.timeout if timeout is None else timeout)
+
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def _forget(self, key: Hashable, call: asyncio.Future):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+        # Mark the exception as retrieved, every caller may have given up on it
+        if not call.cancelled():
+            call.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "shared": self.shared,
+            "timeouts": self.timeouts,
+        }
@@ -1,9 +1,299 @@
+import asyncio
+import logging
 import os
-import psycopg
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Hashable, Optional
+
+from fastapi import HTTPException
+from psycopg import AsyncConnection
+from psycopg.conninfo import conninfo_to_dict
+from psycopg_pool import AsyncConnectionPool, PoolTimeout, TooManyRequests
+
+import profiling
+from cache import TTLCache
+from metrics import CONNECTION_ACQUIRE_DURATION, TimedCursor, TimedServerCursor, register_stats
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "Database url missing!!")
 
+# Comma separated read replicas of DATABASE_URL, see get_read_connection()
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+
+# Replicas further behind than this are taken out of rotation until they catch up
+REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5"))  # seconds
+REPLICA_CHECK_INTERVAL = float(
+    os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "1"))  # seconds
+
+# A replica in rotation is at most this far behind, reads of what was just
+# written go to the primary for that long
+READ_YOUR_WRITES_WINDOW = float(os.getenv(
+    "DATABASE_READ_YOUR_WRITES_WINDOW", str(REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL)))  # seconds
+
+# Pool sizing, tune these with the numbers exposed by pool_stats()
+POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+POOL_MAX_IDLE = float(os.getenv("DATABASE_POOL_MAX_IDLE", "300"))  # seconds
+POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "10"))  # seconds
+# Requests that may queue for a connection, beyond it they are turned away at
+# once instead of piling up on a database that is already saturated. 0 is unbounded
+POOL_MAX_WAITING = int(os.getenv("DATABASE_POOL_MAX_WAITING", "50"))
+
+# Statements run this many times on a connection are prepared on it
+PREPARE_THRESHOLD = int(os.getenv("DATABASE_PREPARE_THRESHOLD", "5"))
+
+
+def prepared_statements_enabled(url: str) -> bool:
+    """
+    DATABASE_PREPARE=1 or 0 forces it, by default prepared statements are
+    only disabled through Supabase's transaction pooler (port 6543), which
+    may run each transaction on a different server connection
+    """
+    setting = os.getenv("DATABASE_PREPARE", "auto")
+    if setting != "auto":
+        return setting == "1"
+
+    try:
+        return conninfo_to_dict(url).get("port") != "6543"
+
+    except Exception:
+        return True
+
+
+# Passed as prepare= by the hot statements: prepared on their first run, or
+# never when prepared statements are disabled
+PREPARE = True if all(
+    prepared_statements_enabled(url) for url in [DATABASE_URL, *DATABASE_REPLICA_URLS]
+) else None
+
+
+async def configure_connection(conn: AsyncConnection):
+    # Time every statement for /metrics
+    conn.cursor_factory = TimedCursor
+    conn.server_cursor_factory = TimedServerCursor
+
+
+def new_pool(url: str, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE) -> AsyncConnectionPool:
+    return AsyncConnectionPool(
+        url,
+        min_size=min_size,
+        max_size=max_size,
+        max_idle=POOL_MAX_IDLE,
+        timeout=POOL_TIMEOUT,
+        max_waiting=POOL_MAX_WAITING,
+        # Discard dead connections on checkout
+        check=AsyncConnectionPool.check_connection,
+        configure=configure_connection,
+        kwargs={"prepare_threshold": PREPARE_THRESHOLD if PREPARE else None},
+        open=False,
+    )
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.pool = new_pool(url)
+        try:
+            info = conninfo_to_dict(url)
+            self.name = f"{info.get('host', '')}:{info.get('port', '5432')}/{info.get('dbname', '')}"
+
+        except Exception:
+            self.name = "replica"
+
+        self.in_flight = 0
+        # Out of rotation until the first check
+        self.lag: Optional[float] = None
+        self.in_rotation = False
+
+    async def check(self):
+        """Measure how far behind the primary the replica is, and put it in or out of rotation"""
+        try:
+            async with self.pool.connection(timeout=REPLICA_MAX_LAG) as conn:
+                cursor = await conn.execute("""
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        -- Everything received is applied, it is as recent as the primary
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+                    END
+                """)
+                self.lag = float((await cursor.fetchone())[0])
+
+        except Exception as e:
+            if self.in_rotation:
+                logger.warning("Replica %s out of rotation: %s", self.name, e)
+            self.lag = None
+            self.in_rotation = False
+            return
+
+        in_rotation = self.lag <= REPLICA_MAX_LAG
+        if in_rotation != self.in_rotation:
+            logger.warning("Replica %s %s rotation, %.1fs behind", self.name,
+                           "in" if in_rotation else "out of", self.lag)
+        self.in_rotation = in_rotation
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "in_rotation": self.in_rotation,
+            "lag_seconds": self.lag,
+            "in_flight": self.in_flight,
+            **pool_stats(self.pool),
+        }
+
+
+# The pools are opened and closed by the FastAPI lifespan in main.py
+pool = new_pool(DATABASE_URL)
+replicas = [Replica(url) for url in DATABASE_REPLICA_URLS]
+replica_monitor: Optional[asyncio.Task] = None
+
+# Keys of what each worker wrote recently, like ("user", id) or ("product", id)
+recent_writes = TTLCache(max_size=100000, ttl=READ_YOUR_WRITES_WINDOW)
+
+
+async def monitor_replicas():
+    while True:
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+        await asyncio.gather(*(replica.check() for replica in replicas))
+
+
+async def open_pool():
+    global replica_monitor
+
+    await pool.open(wait=True)
+    if replicas:
+        # Replicas that can't be reached stay out of rotation, they don't hold up the startup
+        for replica in replicas:
+            await replica.pool.open(wait=False)
+        await asyncio.gather(*(replica.check() for replica in replicas))
+        replica_monitor = asyncio.create_task(monitor_replicas())
+
+
+async def close_pool():
+    if replica_monitor is not None:
+        replica_monitor.cancel()
+    for replica in replicas:
+        await replica.pool.close()
+    await pool.close()
+
+
+@asynccontextmanager
+async def borrow(connection_pool: AsyncConnectionPool):
+    started = time.perf_counter()
+    try:
+        async with connection_pool.connection() as conn:
+            seconds = time.perf_counter() - started
+            CONNECTION_ACQUIRE_DURATION.observe(seconds)
+            profiling.record("connection", seconds)
+            yield conn
+
+    except PoolTimeout:
+        raise HTTPException(
+            status_code=503, detail="No database connection available", headers={"Retry-After": "1"})
+
+    except TooManyRequests:
+        raise HTTPException(
+            status_code=503, detail="Too many requests waiting for the database", headers={"Retry-After": "1"})
+
+
+@asynccontextmanager
+async def get_db_connection():
+    """
+    Borrow a connection from the pool of the primary. The transaction is
+    committed when the block exits normally and rolled back if it raises.
+    """
+    async with borrow(pool) as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def get_dedicated_connection():
+    """
+    A connection of its own for long reads, like exports, that would hold a
+    pooled connection for minutes. From the least behind replica in rotation,
+    so a long snapshot doesn't hold back vacuum on the primary, or from the
+    primary when there is none. Closed when the block exits.
+    """
+    candidates = [replica for replica in replicas if replica.in_rotation]
+    url = min(
+        candidates, key=lambda replica: replica.lag).url if candidates else DATABASE_URL
+
+    async with await AsyncConnection.connect(url) as conn:
+        await configure_connection(conn)
+        yield conn
+
+
+def note_write(*keys: Hashable):
+    """
+    Mark what a request wrote, e.g. ("user", user.id) or ("product", product_id),
+    so reads of it stay on the primary until every replica has it. Other
+    workers learn of user and product writes through LISTEN, see invalidation
+    """
+    if replicas:
+        for key in keys:
+            recent_writes.set(key, True)
+
+
+@asynccontextmanager
+async def get_read_connection(*keys: Hashable):
+    """
+    Borrow a connection for reads that may be slightly behind, from the least
+    busy replica in rotation. Falls back to the primary when there is none, or
+    when any of `keys` was written recently, see note_write()
+    """
+    candidates = [replica for replica in replicas if replica.in_rotation]
+    if not candidates or any(recent_writes.get(key) for key in keys):
+        async with borrow(pool) as conn:
+            yield conn
+        return
+
+    replica = min(candidates, key=lambda replica: (
+        replica.in_flight, random.random()))
+    replica.in_flight += 1
+    try:
+        async with borrow(replica.pool) as conn:
+            yield conn
+
+    finally:
+        replica.in_flight -= 1
+
+
+def pool_stats(connection_pool: AsyncConnectionPool = pool):
+    stats = connection_pool.get_stats()
+
+    return {
+        "min_size": stats.get("pool_min", 0),
+        "max_size": stats.get("pool_max", 0),
+        "size": stats.get("pool_size", 0),
+        "available": stats.get("pool_available", 0),
+        "in_use": stats.get("pool_size", 0) - stats.get("pool_available", 0),
+        "waiting": stats.get("requests_waiting", 0),
+        "requests": stats.get("requests_num", 0),
+        "requests_queued": stats.get("requests_queued", 0),
+        "wait_ms": stats.get("requests_wait_ms", 0),
+        "checkout_failures": stats.get("requests_errors", 0),
+        "connections_failed": stats.get("connections_errors", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+    }
+
+
+def replica_stats():
+    return [replica.stats() for replica in replicas]
+
+
+def replica_summary():
+    lags = [replica.lag for replica in replicas if replica.lag is not None]
+
+    return {
+        "configured": len(replicas),
+        "in_rotation": sum(replica.in_rotation for replica in replicas),
+        "max_lag_seconds": max(lags, default=0),
+    }
+
 
-def get_db_connection():
-    conn = psycopg.connect(DATABASE_URL)
-    return conn
+register_stats("chopchop_db_pool", "Connection pool", pool_stats)
+register_stats("chopchop_db_replicas", "Read replicas", replica_summary)
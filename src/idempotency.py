@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from psycopg import AsyncCursor
+from psycopg.types.json import Jsonb
+
+from cache import SingleFlight, TTLCache
+from database import get_db_connection
+from model.user import User
+
+logger = logging.getLogger(__name__)
+
+# Retries with the same key within this time get the stored response
+KEY_TTL = float(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))  # seconds
+
+# Time a request waits for a concurrent one with the same key to finish
+WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))  # seconds
+
+# Expired keys deleted per statement by expire_idempotency_keys
+EXPIRE_BATCH_SIZE = 5000
+
+# Recent keys, so most retries are answered without the database
+idempotency_cache = TTLCache(
+    max_size=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")),
+    ttl=min(KEY_TTL, float(os.getenv("IDEMPOTENCY_CACHE_TTL", "600"))),  # seconds
+)
+
+# Duplicates sent to this worker wait on the first request, duplicates sent to
+# other workers wait on its row lock in chopchop.idempotency_key
+idempotency_flight = SingleFlight(timeout=WAIT_TIMEOUT)
+
+
+def fingerprint(endpoint: str, request: Any) -> str:
+    body = json.dumps(jsonable_encoder(request), sort_keys=True)
+    return hashlib.sha256(f"{endpoint}\n{body}".encode()).hexdigest()
+
+
+async def run_once(
+    user: User,
+    key: str,
+    endpoint: str,
+    request: Any,
+    run: Callable[[AsyncCursor], Awaitable[Any]],
+) -> tuple[Any, bool]:
+    """
+    Run `run` in a transaction, unless a request with the same key already
+    succeeded. Returns the JSON encoded response and whether it is a replay.
+    Failed requests aren't stored, retrying them runs them again.
+    """
+    request_fingerprint = fingerprint(endpoint, request)
+    cache_key = (user.id, key)
+    # Only set for the first of concurrent duplicates, the others share its result
+    executed = False
+
+    async def execute():
+        nonlocal executed
+        executed = True
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cursor:
+                    stored = await claim(cursor, user, key, endpoint, request_fingerprint)
+                    if stored is None:
+                        response = jsonable_encoder(await run(cursor))
+                        await cursor.execute(
+                            """
+                            UPDATE chopchop.idempotency_key SET ik_response = %s
+                            WHERE ik_user = %s AND ik_key = %s
+                            """,
+                            (Jsonb(response), user.id, key),
+                        )
+                        stored = (request_fingerprint, response, False)
+
+        idempotency_cache.set(cache_key, stored[:2])
+        return stored
+
+    cached = idempotency_cache.get(cache_key)
+    if cached is not None:
+        stored_fingerprint, response = cached
+        replayed = True
+
+    else:
+        try:
+            stored_fingerprint, response, replayed = await idempotency_flight.do(cache_key, execute)
+
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=409, detail="A request with this Idempotency-Key is still being processed")
+
+        replayed = replayed or not executed
+
+    if stored_fingerprint != request_fingerprint:
+        raise HTTPException(
+            status_code=422, detail="This Idempotency-Key was used with a different request")
+
+    return response, replayed
+
+
+async def claim(cursor: AsyncCursor, user: User, key: str, endpoint: str, request_fingerprint: str):
+    """
+    Claim the key for this request, or return the fingerprint and response of
+    the request that has it. Blocks while another transaction holds the key,
+    expired keys are claimed again
+    """
+    await cursor.execute(
+        """
+        INSERT INTO chopchop.idempotency_key (ik_user, ik_key, ik_endpoint, ik_fingerprint)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (ik_user, ik_key) DO UPDATE SET
+            ik_endpoint = EXCLUDED.ik_endpoint,
+            ik_fingerprint = EXCLUDED.ik_fingerprint,
+            ik_response = NULL,
+            ik_created_at = now()
+        WHERE chopchop.idempotency_key.ik_created_at < now() - make_interval(secs => %s)
+        RETURNING ik_key
+        """,
+        (user.id, key, endpoint, request_fingerprint, KEY_TTL),
+    )
+    if await cursor.fetchone() is not None:
+        return None
+
+    await cursor.execute(
+        """
+        SELECT ik_fingerprint, ik_response
+        FROM chopchop.idempotency_key
+        WHERE ik_user = %s AND ik_key = %s
+        """,
+        (user.id, key),
+    )
+    stored_fingerprint, response = await cursor.fetchone()
+    return stored_fingerprint, response, True
+
+
+async def expire_idempotency_keys():
+    """Delete the expired keys, in batches, every so often. Runs until cancelled"""
+    while True:
+        try:
+            deleted = EXPIRE_BATCH_SIZE
+            while deleted == EXPIRE_BATCH_SIZE:
+                async with get_db_connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            """
+                            DELETE FROM chopchop.idempotency_key
+                            WHERE ctid IN (
+                                SELECT ctid FROM chopchop.idempotency_key
+                                WHERE ik_created_at < now() - make_interval(secs => %s)
+                                LIMIT %s
+                            )
+                            """,
+                            (KEY_TTL, EXPIRE_BATCH_SIZE),
+                        )
+                        deleted = cursor.rowcount
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            logger.warning("Could not delete expired idempotency keys: %s", e)
+
+        await asyncio.sleep(min(KEY_TTL, 3600))
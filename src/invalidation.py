@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+from uuid import UUID
+
+import psycopg
+
+from database import DATABASE_URL, note_write
+from model.product.listing import listing_cache
+from model.product.product import product_cache
+
+logger = logging.getLogger(__name__)
+
+# LISTEN needs a session, Supabase's transaction pooler (port 6543) can't be
+# used here. Point this to the session pooler or a direct connection
+DATABASE_LISTEN_URL = os.getenv("DATABASE_LISTEN_URL", DATABASE_URL)
+
+# Sent by the triggers in sql/migrations/0004_product_notify.sql,
+# sql/migrations/0005_catalog_notify.sql and sql/migrations/0011_purchase_notify.sql
+PRODUCT_CHANNEL = "chopchop_product"
+CATALOG_CHANNEL = "chopchop_catalog"
+USER_CHANNEL = "chopchop_user"
+
+# Time to live of the cached products while notifications can't be received
+FALLBACK_TTL = float(os.getenv("CACHE_FALLBACK_TTL", "5"))  # seconds
+MIN_BACKOFF = 1  # seconds
+MAX_BACKOFF = 60  # seconds
+
+# A connection that silently dropped, without a reset from the server, would
+# wait for notifications forever. It runs SELECT 1 this often, and reconnects
+# when it doesn't answer in time
+CHECK_INTERVAL = float(
+    os.getenv("CACHE_LISTEN_CHECK_INTERVAL", "10"))  # seconds
+CHECK_TIMEOUT = float(os.getenv("CACHE_LISTEN_CHECK_TIMEOUT", "5"))  # seconds
+
+# Caches that hold data other workers can change, with their normal time to live
+CACHES = {
+    product_cache: product_cache.ttl,
+    listing_cache: listing_cache.ttl,
+}
+
+
+def handle_notification(notify: psycopg.Notify):
+    match notify.channel:
+        case "chopchop_product":
+            product_id = UUID(notify.payload)
+            product_cache.delete(product_id)
+            # Replicas may not have the change yet, don't cache it again from one
+            note_write(("product", product_id))
+
+        case "chopchop_catalog":
+            listing_cache.expire()
+
+        case "chopchop_user":
+            # Read your writes on every worker, not only the one that wrote
+            note_write(("user", UUID(notify.payload)))
+
+
+def set_listening(listening: bool):
+    """
+    Changes may have been missed while not listening, drop everything cached
+    and keep new entries short lived until notifications arrive again
+    """
+    for cache, ttl in CACHES.items():
+        cache.clear()
+        cache.ttl = ttl if listening else min(ttl, FALLBACK_TTL)
+
+
+async def listen_for_changes(url: str = DATABASE_LISTEN_URL, listening: asyncio.Event | None = None):
+    """
+    Evict the local caches when another worker changes a product, and keep the
+    reads of users that wrote on the primary. Sets `listening` once LISTEN
+    succeeds. Runs until cancelled
+    """
+    backoff = MIN_BACKOFF
+    set_listening(False)
+
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(url, autocommit=True) as conn:
+                await conn.execute(f"LISTEN {PRODUCT_CHANNEL}")
+                await conn.execute(f"LISTEN {CATALOG_CHANNEL}")
+                await conn.execute(f"LISTEN {USER_CHANNEL}")
+                set_listening(True)
+                if listening is not None:
+                    listening.set()
+                backoff = MIN_BACKOFF
+
+                while True:
+                    async for notify in conn.notifies(timeout=CHECK_INTERVAL):
+                        handle_notification(notify)
+                    await asyncio.wait_for(conn.execute("SELECT 1"), CHECK_TIMEOUT)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            logger.warning(
+                "Cache invalidation listener disconnected, retrying in %ss: %s", backoff, e)
+
+        set_listening(False)
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, MAX_BACKOFF)
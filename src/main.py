@@ -1,8 +1,18 @@
 __version__ = "0.2.3"
 
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from database import open_pool, close_pool
+from idempotency import expire_idempotency_keys
+from invalidation import listen_for_changes
+from metrics import MetricsMiddleware
+from profiling import ProfilingMiddleware
+from ratelimit import BACKEND as RATE_LIMIT_BACKEND, RateLimitMiddleware, buckets, expire_rate_limit_buckets
+from model.product.listing import warm_listing_cache
 
 from api.product.get import router as product_get_router
 from api.product.delete import router as product_delete_router
@@ -10,31 +20,76 @@ from api.product.post import router as product_post_router
 from api.product.put import router as product_put_router
 
 from api.products.get import router as products_get_router
+from api.products.post import router as products_post_router
 
 from api.purchase.get import router as purchase_get_router
 from api.purchase.post import router as purchase_post_router
+from api.purchases.get import router as purchases_get_router
+from api.sales.get import router as sales_get_router
+
+from api.stats.get import router as stats_get_router
+
+from api.metrics.get import router as metrics_get_router
 
 
-api = FastAPI()
+@asynccontextmanager
+async def lifespan(api: FastAPI):
+    await open_pool()
+    listening = asyncio.Event()
+    listener = asyncio.create_task(listen_for_changes(listening=listening))
+    warmer = asyncio.create_task(warm_listing_cache(listening))
+    expirer = asyncio.create_task(expire_idempotency_keys())
+    if RATE_LIMIT_BACKEND == "postgres":
+        # Requests are limited by the local buckets until it connects
+        await buckets.pool.open(wait=False)
+        bucket_expirer = asyncio.create_task(expire_rate_limit_buckets())
+    yield
+    if RATE_LIMIT_BACKEND == "postgres":
+        bucket_expirer.cancel()
+        await buckets.pool.close()
+    expirer.cancel()
+    warmer.cancel()
+    listener.cancel()
+    await close_pool()
+
+
+api = FastAPI(lifespan=lifespan)
 
 origins = [
     "*",
 ]
 
+# Inside CORS, so browsers can read the 429 responses
+api.add_middleware(RateLimitMiddleware)
+
 api.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Export-Since"],
 )
 
+# Outermost, so they also time the CORS middleware and the error responses
+api.add_middleware(ProfilingMiddleware)
+api.add_middleware(MetricsMiddleware)
+
 api.include_router(product_get_router)
 api.include_router(product_delete_router)
 api.include_router(product_post_router)
 api.include_router(product_put_router)
 
 api.include_router(products_get_router)
+api.include_router(products_post_router)
 
 api.include_router(purchase_get_router)
 api.include_router(purchase_post_router)
+
+api.include_router(purchases_get_router)
+
+api.include_router(sales_get_router)
+
+api.include_router(stats_get_router)
+
+api.include_router(metrics_get_router)
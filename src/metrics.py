@@ -0,0 +1,154 @@
+import sys
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from psycopg import AsyncCursor, AsyncServerCursor
+
+from profiling import statement_executed
+
+# Database operations are mostly sub-millisecond, the default buckets start at 5ms
+DATABASE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01,
+                    0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_DURATION = Histogram(
+    "chopchop_http_request_duration_seconds",
+    "Time to answer a request, including streamed bodies, by route template",
+    ["method", "route"],
+)
+REQUESTS = Counter(
+    "chopchop_http_requests_total",
+    "Answered requests by route template and status code",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "chopchop_http_requests_in_flight",
+    "Requests being answered",
+    ["method"],
+)
+RATE_LIMITED = Counter(
+    "chopchop_rate_limited_total",
+    "Requests answered 429 by the rate limiter, by kind of bucket: user or ip",
+    ["bucket"],
+)
+QUERY_DURATION = Histogram(
+    "chopchop_db_query_duration_seconds",
+    "Time to execute a statement and receive its results, by the function that ran it",
+    ["statement"],
+    buckets=DATABASE_BUCKETS,
+)
+CONNECTION_ACQUIRE_DURATION = Histogram(
+    "chopchop_db_connection_acquire_seconds",
+    "Time waited for a connection from the pool",
+    buckets=DATABASE_BUCKETS,
+)
+
+
+class MetricsMiddleware:
+    """
+    Times every request by the template of the route that answered it, so
+    /product/{product_id} is a single series. Plain ASGI, a BaseHTTPMiddleware
+    would add a task and a copy of the body to each request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_with_status)
+
+        finally:
+            in_flight.dec()
+
+            # Set by the router once a route matches, unmatched paths share a
+            # series so they can't blow up the number of labels
+            route = scope.get("route")
+            template = getattr(route, "path", "unmatched")
+
+            REQUEST_DURATION.labels(method, template).observe(
+                time.perf_counter() - started)
+            REQUESTS.labels(method, template, str(status)).inc()
+
+
+def statement_name() -> str:
+    """Module and qualified name of the function running a statement, e.g. model.purchase:Purchase.insert"""
+    # Skip this module and psycopg, but not psycopg_pool, whose checkout
+    # health checks are worth telling apart
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get("__name__", "").split(".")[0] in ("psycopg", __name__):
+        frame = frame.f_back
+
+    if frame is None:
+        return "unknown"
+
+    return f"{frame.f_globals.get('__name__')}:{frame.f_code.co_qualname}"
+
+
+class TimedCursor(AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        name = statement_name()
+        started = time.perf_counter()
+        try:
+            await super().execute(query, params, **kwargs)
+
+        finally:
+            seconds = time.perf_counter() - started
+            QUERY_DURATION.labels(name).observe(seconds)
+
+        await statement_executed(self, name, query, params, seconds)
+        return self
+
+    async def executemany(self, query, params_seq, **kwargs):
+        statement = QUERY_DURATION.labels(statement_name())
+        started = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+
+        finally:
+            statement.observe(time.perf_counter() - started)
+
+
+class TimedServerCursor(AsyncServerCursor):
+    # Only declaring the cursor is timed, the rows are fetched afterwards
+    async def execute(self, query, params=None, **kwargs):
+        statement = QUERY_DURATION.labels(statement_name())
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+
+        finally:
+            statement.observe(time.perf_counter() - started)
+
+
+class StatsCollector:
+    """Exposes the numbers of a stats() function, like database.pool_stats, as gauges"""
+
+    def __init__(self, prefix: str, description: str, stats):
+        self.prefix = prefix
+        self.description = description
+        self.stats = stats
+
+    def collect(self):
+        for name, value in self.stats().items():
+            yield GaugeMetricFamily(f"{self.prefix}_{name}", f"{self.description}: {name}", value=value)
+
+
+def register_stats(prefix: str, description: str, stats):
+    REGISTRY.register(StatsCollector(prefix, description, stats))
@@ -0,0 +1,340 @@
+import csv
+import json
+import os
+from typing import AsyncIterator
+
+from fastapi import HTTPException
+from psycopg import AsyncConnection, sql
+from pydantic import ValidationError
+
+from database import get_db_connection
+from model.product.product import NewProduct
+from model.user import User, Professional, Enterprise
+
+# Valid rows are loaded, and committed unless the import is atomic, in chunks
+# of this many products
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+# Valid rows an atomic import holds in memory before loading them
+IMPORT_MAX_ATOMIC_ROWS = int(os.getenv("IMPORT_MAX_ATOMIC_ROWS", "100000"))
+
+# Row errors returned by an import, the rest are only counted
+IMPORT_MAX_ERRORS = 1000
+
+# Longest line, or CSV record spanning several lines, read from an upload.
+# Longer ones are reported as invalid rows instead of held in memory
+IMPORT_MAX_RECORD_SIZE = int(
+    os.getenv("IMPORT_MAX_RECORD_SIZE", str(1024 * 1024)))  # bytes
+
+
+def decode_line(line: bytes) -> str | ValueError:
+    try:
+        return line.decode().removesuffix("\r")
+
+    except UnicodeDecodeError as e:
+        return ValueError(f"Not valid UTF-8, at byte {e.start}")
+
+
+async def read_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str | ValueError]:
+    """
+    Each line of the upload, or the reason it couldn't be read. Lines longer
+    than IMPORT_MAX_RECORD_SIZE are dropped as they arrive, not buffered
+    """
+    buffer = b""
+    too_long = False
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if too_long:
+                # The end of the line that was dropped
+                too_long = False
+                yield ValueError(f"Longer than {IMPORT_MAX_RECORD_SIZE} bytes")
+            else:
+                yield decode_line(line)
+
+        if len(buffer) > IMPORT_MAX_RECORD_SIZE:
+            too_long = True
+            buffer = b""
+
+    if too_long:
+        yield ValueError(f"Longer than {IMPORT_MAX_RECORD_SIZE} bytes")
+    elif buffer:
+        yield decode_line(buffer)
+
+
+async def read_ndjson(stream: AsyncIterator[bytes]):
+    """(row number, object or the reason it couldn't be read) of each line"""
+    row_number = 0
+    async for line in read_lines(stream):
+        if isinstance(line, ValueError):
+            row_number += 1
+            yield row_number, line
+            continue
+
+        if not line.strip():
+            continue
+
+        row_number += 1
+        try:
+            row = json.loads(line)
+            yield row_number, row if isinstance(row, dict) else ValueError("Expected a JSON object")
+
+        except ValueError as e:
+            yield row_number, e
+
+
+def in_quoted_field(line: str, in_quotes: bool) -> bool:
+    """
+    Whether a quoted field is still open at the end of `line`, a line of a
+    record that starts inside one if `in_quotes`. As for csv.reader, a quote
+    only opens a field at its start, elsewhere it is a character like any
+    other, e.g. TV 5" screen. Inside a field doubled quotes are escaped ones
+    """
+    pos = 0
+    if not in_quotes and line.startswith('"'):
+        in_quotes, pos = True, 1
+
+    while True:
+        if in_quotes:
+            end = line.find('"', pos)
+            while end != -1 and line.startswith('"', end + 1):
+                end = line.find('"', end + 2)
+            if end == -1:
+                return True
+            in_quotes, pos = False, end + 1
+
+        start = line.find(',"', pos)
+        if start == -1:
+            return False
+        in_quotes, pos = True, start + 2
+
+
+def parse_record(text: str) -> list[str]:
+    try:
+        return next(csv.reader([text]))
+
+    except csv.Error as e:
+        raise ValueError(str(e))
+
+
+async def read_csv(stream: AsyncIterator[bytes]):
+    """(row number, row by column or the reason it couldn't be read) of each record after the header"""
+    header = None
+    record = []
+    record_size = 0
+    # Set when the record can't be read, its lines are only counted until it ends
+    record_error = None
+    in_quotes = False
+    row_number = 0
+
+    async for line in read_lines(stream):
+        if isinstance(line, ValueError):
+            # The quotes of the line are unknown, the next line starts a new record
+            record_error = line
+            in_quotes = False
+
+        else:
+            # Quoted fields can span several lines, a record ends on a line
+            # that leaves them all closed
+            in_quotes = in_quoted_field(line, in_quotes)
+            record_size += len(line) + 1
+            if record_error is None and record_size > IMPORT_MAX_RECORD_SIZE:
+                record_error = ValueError(
+                    f"Longer than {IMPORT_MAX_RECORD_SIZE} bytes")
+            if record_error is None:
+                record.append(line)
+
+            if in_quotes:
+                continue
+
+        text = "\n".join(record)
+        error = record_error
+        record = []
+        record_size = 0
+        record_error = None
+        if error is None and not text.strip():
+            continue
+
+        if header is None:
+            try:
+                if error is not None:
+                    raise error
+                header = [field.strip().lower()
+                          for field in parse_record(text)]
+
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=400, detail=f"Could not read the CSV header: {e}")
+
+            header[0] = header[0].removeprefix("\ufeff")
+            continue
+
+        row_number += 1
+        try:
+            if error is not None:
+                raise error
+            fields = parse_record(text)
+
+        except ValueError as e:
+            yield row_number, e
+            continue
+
+        if len(fields) != len(header):
+            yield row_number, ValueError(f"Expected {len(header)} fields, got {len(fields)}")
+        else:
+            yield row_number, dict(zip(header, fields))
+
+    if record or record_error is not None:
+        yield row_number + 1, record_error or ValueError("Unterminated quoted field")
+
+
+def parse_row(row: dict):
+    """VerifiedProduct of an imported row, rows without a type are verified products"""
+    try:
+        new_product = NewProduct.model_validate({"type": "verified", **row})
+
+    except ValidationError as e:
+        raise ValueError("; ".join(
+            f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()
+        ))
+
+    if new_product.type != NewProduct.Type.VERIFIED:
+        raise ValueError("Only verified products can be imported")
+
+    try:
+        return new_product.factory()
+
+    except Exception as e:
+        raise ValueError(str(e))
+
+
+async def import_products(
+    user: User,
+    rows: AsyncIterator[tuple[int, dict | Exception]],
+    skip: int = 0,
+    atomic: bool = False,
+):
+    """
+    Load the verified products of an upload with COPY. Invalid rows are
+    reported and skipped. Chunks are committed as they are loaded, if one
+    fails the import stops and `committed` is the `skip` that resumes it.
+    An atomic import loads nothing unless every row is valid, its rows are
+    read before loading them in a single transaction.
+
+    A connection is only borrowed once a chunk is read, a slow upload doesn't
+    hold one, nor a transaction, while waiting on the network.
+    """
+    if not (isinstance(user, Professional) or isinstance(user, Enterprise)):
+        raise HTTPException(
+            status_code=403, detail="This user is not allowed to post verified products")
+
+    result = {"imported": 0, "committed": skip,
+              "complete": True, "failed": 0, "errors": []}
+    products = []
+
+    def add_error(row_number: int, error):
+        result["failed"] += 1
+        if len(result["errors"]) < IMPORT_MAX_ERRORS:
+            result["errors"].append({"row": row_number, "error": str(error)})
+
+    async def load(conn: AsyncConnection, chunk: list):
+        await copy_products(conn, user, chunk)
+        result["imported"] += len(chunk)
+
+    async def commit(last_row: int):
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                await load(conn, products)
+
+        result["committed"] = last_row
+        products.clear()
+
+    async def run():
+        last_row = skip
+        async for row_number, row in rows:
+            if row_number <= skip:
+                continue
+            last_row = row_number
+
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                product = parse_row(row)
+
+            except ValueError as e:
+                add_error(row_number, e)
+                continue
+
+            # Nothing is loaded once an atomic import has an invalid row
+            if not (atomic and result["failed"]):
+                products.append(product)
+
+            if atomic and len(products) > IMPORT_MAX_ATOMIC_ROWS:
+                raise HTTPException(
+                    status_code=413, detail=f"Atomic imports are limited to {IMPORT_MAX_ATOMIC_ROWS} products")
+
+            if not atomic and len(products) >= IMPORT_CHUNK_SIZE:
+                await commit(last_row)
+
+        if not atomic:
+            if products:
+                await commit(last_row)
+            result["committed"] = last_row
+
+        elif not result["failed"]:
+            async with get_db_connection() as conn:
+                async with conn.transaction():
+                    for start in range(0, len(products), IMPORT_CHUNK_SIZE):
+                        await load(conn, products[start:start + IMPORT_CHUNK_SIZE])
+            result["committed"] = last_row
+
+    try:
+        await run()
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        # A chunk the database rejected, everything before it is committed
+        # unless the import is atomic
+        if atomic:
+            result["imported"] = 0
+            result["committed"] = skip
+
+        result["complete"] = False
+        add_error(result["committed"] + 1,
+                  f"Rejected by the database, import again from here: {e}")
+
+    return result
+
+
+async def copy_products(conn: AsyncConnection, user: User, products: list):
+    async with conn.cursor() as cursor:
+        # One statement allocates the ids of the whole chunk
+        await cursor.execute(
+            sql.SQL("""
+                INSERT INTO chopchop.product_id
+                SELECT FROM generate_series(1, %s)
+                RETURNING product_id
+            """),
+            (len(products),),
+        )
+        product_ids = [row[0] for row in await cursor.fetchall()]
+
+        async with cursor.copy(sql.SQL("""
+            COPY chopchop.verified_product (vp_id, vp_owner, vp_sku, vp_name, vp_description, vp_stock, vp_price, vp_image, vp_category)
+            FROM STDIN
+        """)) as copy:
+            for product_id, product in zip(product_ids, products):
+                await copy.write_row((
+                    product_id,
+                    user.id,
+                    product.sku,
+                    product.name,
+                    product.description,
+                    product.stock,
+                    product.price,
+                    product.image,
+                    product.category.value,
+                ))
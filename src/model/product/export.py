@@ -0,0 +1,103 @@
+import csv
+import io
+import json
+import os
+from enum import Enum
+from typing import Optional
+
+from database import get_dedicated_connection
+
+# Rows fetched from the server-side cursor and sent to the client at a time
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+COLUMNS = ["id", "type", "name", "description", "image",
+           "price", "category", "created_at", "updated_at", "deleted"]
+
+
+class ExportFormat(Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+    @property
+    def media_type(self):
+        return "application/x-ndjson" if self == ExportFormat.NDJSON else "text/csv"
+
+
+def encode_rows(export_format: ExportFormat, rows, header: bool = False) -> str:
+    """Deleted entries only have their id and deleted set"""
+    if export_format == ExportFormat.NDJSON:
+        return "".join(
+            json.dumps({"id": str(row[0]), "deleted": True} if row[9] else {
+                "id": str(row[0]),
+                "type": row[1],
+                "name": row[2],
+                "description": row[3],
+                "image": row[4],
+                "price": float(row[5]),
+                "category": row[6],
+                "created_at": row[7].isoformat(),
+                "updated_at": row[8].isoformat(),
+                "deleted": False,
+            }, ensure_ascii=False) + "\n"
+            for row in rows
+        )
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    writer.writerows(
+        (row[0], "", "", "", "", "", "", "", "", "true") if row[9] else
+        (row[0], row[1], row[2], row[3], row[4], row[5],
+         row[6], row[7].isoformat(), row[8].isoformat(), "false")
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+async def export_products(export_format: ExportFormat, since: Optional[int] = None):
+    """
+    Every catalog entry, or the changes since the `since` of a previous
+    export, deletions included. The first value is the `since` of the next
+    export: the oldest transaction still running, changes made by it and
+    later ones weren't all visible yet. Changes from before it may be sent
+    again, applying them twice is harmless.
+
+    Rows are read through a server-side cursor in batches, so memory doesn't
+    grow with the catalog, on a connection of its own. The first chunk is
+    yielded once the query is running, before that nothing has been sent and
+    errors can still be answered with a status code.
+    """
+    query = """
+        SELECT pc_id, pc_type, pc_name, pc_description, pc_image, pc_price, pc_category, pc_created_at, pc_updated_at,
+            false, pc_change
+        FROM chopchop.product_catalog
+    """
+    params = []
+    if since is not None:
+        query += """
+            WHERE pc_change >= %s::text::xid8
+            UNION ALL
+            SELECT pcd_id, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, true, pcd_change
+            FROM chopchop.product_catalog_deleted
+            WHERE pcd_change >= %s::text::xid8
+        """
+        params += [since, since]
+    query += " ORDER BY 11, 1"
+
+    async with get_dedicated_connection() as conn:
+        # Named cursors only live inside a transaction
+        async with conn.transaction():
+            cursor = await conn.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::numeric")
+            yield int((await cursor.fetchone())[0])
+
+            async with conn.cursor(name="product_export") as cursor:
+                await cursor.execute(query, params)
+
+                rows = await cursor.fetchmany(EXPORT_BATCH_SIZE)
+                yield encode_rows(export_format, rows, header=True)
+
+                while rows:
+                    rows = await cursor.fetchmany(EXPORT_BATCH_SIZE)
+                    if rows:
+                        yield encode_rows(export_format, rows)
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from fastapi import HTTPException
+
+from cache import RefreshingCache, SingleFlight
+from database import get_read_connection
+from model.product.product import Product
+
+logger = logging.getLogger(__name__)
+
+# Pages of GET /products by their normalized filters. Any change to the
+# catalog marks every page stale (see invalidation.py), stale pages are served
+# while they are reloaded in the background. A stale ttl of 0 disables that,
+# changes then drop the pages and the next request waits for the database
+listing_cache = RefreshingCache(
+    max_size=int(os.getenv("LISTING_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("LISTING_CACHE_TTL", "30")),  # seconds
+    stale_ttl=float(os.getenv("LISTING_CACHE_STALE_TTL", "300")),  # seconds
+)
+
+# Concurrent identical requests for a page that isn't cached share one query
+listing_flight = SingleFlight(
+    timeout=float(os.getenv("READ_COALESCING_TIMEOUT", "10")),  # seconds
+)
+
+# Pages loaded at startup: the first pages of the unfiltered listing and of
+# the categories with most products
+WARM_CATEGORIES = int(os.getenv("LISTING_WARM_CATEGORIES", "5"))
+WARM_PAGES = int(os.getenv("LISTING_WARM_PAGES", "2"))
+
+
+async def get_listing(
+    query: Optional[str],
+    page: int,
+    category: Optional[Product.Category],
+    price_min: float,
+    price_max: float,
+    sort: Optional[Product.Sort] = None,
+    page_cursor: Optional[str] = None,
+):
+    """Product.get_products, served from the listing cache"""
+    # Search is case insensitive and ignores extra whitespace
+    query = " ".join(query.lower().split()) if query else None
+    sort = Product.default_sort(query, sort)
+    page = 0 if page_cursor else page
+
+    key = (query, category, price_min, price_max, sort, page, page_cursor)
+
+    async def query_page():
+        async with get_read_connection() as conn:
+            async with conn.cursor() as cursor:
+                return await Product.get_products(
+                    cursor, query, page, category, price_min, price_max, sort, page_cursor
+                )
+
+    async def load():
+        return await listing_flight.do(key, query_page)
+
+    try:
+        return await listing_cache.get(key, load)
+
+    except TimeoutError:
+        raise HTTPException(
+            status_code=504, detail="Timed out waiting for the database")
+
+
+async def get_facets(
+    query: Optional[str],
+    category: Optional[Product.Category],
+    price_min: float,
+    price_max: float,
+):
+    """Product.get_facets, cached with the pages they describe when searching.
+    Without search terms they are summed from the catalog counts, cheaper than
+    a cache entry for every price filter"""
+    query = " ".join(query.lower().split()) if query else None
+    key = ("facets", query, category, price_min, price_max)
+
+    async def query_facets():
+        async with get_read_connection() as conn:
+            async with conn.cursor() as cursor:
+                return await Product.get_facets(cursor, query, category, price_min, price_max)
+
+    async def load():
+        return await listing_flight.do(key, query_facets)
+
+    try:
+        if not query:
+            return await load()
+        return await listing_cache.get(key, load)
+
+    except TimeoutError:
+        raise HTTPException(
+            status_code=504, detail="Timed out waiting for the database")
+
+
+async def warm_listing_cache(listening: Optional[asyncio.Event] = None):
+    # Connecting the invalidation listener clears the caches, and until it
+    # does pages expire within seconds. Warm them once it is listening
+    if listening is not None:
+        await listening.wait()
+
+    try:
+        async with get_read_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    SELECT cbc_category FROM chopchop.catalog_bucket_count
+                    GROUP BY cbc_category
+                    ORDER BY sum(cbc_count) DESC
+                    LIMIT %s
+                    """,
+                    (WARM_CATEGORIES,),
+                )
+                categories = [Product.Category(row[0]) for row in await cursor.fetchall()]
+
+        # Follow next_cursor, as the clients do when scrolling
+        for category in [None, *categories]:
+            page_cursor = None
+            for _ in range(WARM_PAGES):
+                listing = await get_listing(
+                    None, 0, category, 0.0, float("inf"), None, page_cursor)
+                page_cursor = listing["next_cursor"]
+                if page_cursor is None:
+                    break
+
+    except Exception as e:
+        # Not fatal, the pages will be cached as they are requested
+        logger.warning("Could not warm the listing cache: %s", e)
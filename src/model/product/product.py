@@ -1,13 +1,33 @@
+import os
+from datetime import datetime
+from decimal import Decimal
 from uuid import UUID
 from enum import Enum
 from typing import Optional
 
 from pydantic import BaseModel
-from psycopg import Cursor
+from psycopg import AsyncCursor, sql
 from fastapi import HTTPException
 
+from cache import SingleFlight, TTLCache
+from database import PREPARE, get_read_connection
+from pagination import decode_page_cursor, encode_page_cursor
+
 PRODUCTS_PER_PAGE = 12
 
+# Serialized product details by id, filled by Product.factory. Every write to a
+# product invalidates its entry, the time to live bounds how long a read racing
+# with an uncommitted write can keep a stale copy
+product_cache = TTLCache(
+    max_size=int(os.getenv("PRODUCT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "60")),  # seconds
+)
+
+# Concurrent lookups of a product that isn't cached share a single query
+product_flight = SingleFlight(
+    timeout=float(os.getenv("READ_COALESCING_TIMEOUT", "10")),  # seconds
+)
+
 
 class Product(BaseModel):
     class Category(Enum):
@@ -36,6 +56,12 @@ class Product(BaseModel):
 
         ALTRES = "altres"
 
+    class Sort(Enum):
+        RELEVANCE = "relevance"
+        NEWEST = "newest"
+        PRICE_ASC = "price_asc"
+        PRICE_DESC = "price_desc"
+
     id: Optional[UUID] = None
     owner: Optional[UUID] = None
     name: str = ""
@@ -44,105 +70,423 @@ class Product(BaseModel):
     image: str = ""
     category: Category = Category.ALTRES
 
+    # Resolves the product type and loads it in the same round trip. Both
+    # branches are primary key lookups, at most one of them returns a row
     @staticmethod
-    def factory(cursor: Cursor, product_id: UUID):
-        query = """
-            SELECT 
-                CASE 
-                    WHEN vp.vp_id IS NOT NULL THEN 'verified'
-                    WHEN sp.sp_id IS NOT NULL THEN 'secondhand'
-                    ELSE 'not found'
-                    END AS product_type
-                FROM 
-                    chopchop.product_id p
-                LEFT JOIN 
-                    chopchop.verified_product vp ON p.product_id = vp.vp_id
-                LEFT JOIN 
-                    chopchop.secondhand_product sp ON p.product_id = sp.sp_id
-                WHERE 
-                    p.product_id = %s;
-        """
-        cursor.execute(query, (product_id,))
+    async def factory(cursor: AsyncCursor, product_id: UUID):
+        cached = product_cache.get(product_id)
+        if cached is not None:
+            product_type, data = cached
+            return product_type.model_construct(**data)
+
+        query = sql.SQL("""
+            SELECT 'verified', vp_id, vp_owner, vp_name, vp_description, vp_price, vp_image, vp_category, vp_sku, vp_stock, vp_sold
+            FROM chopchop.verified_product
+            WHERE vp_id = %s
 
-        match cursor.fetchone()[0]:
+            UNION ALL
+
+            SELECT 'secondhand', sp_id, sp_owner, sp_name, sp_description, sp_price, sp_image, sp_category, NULL, NULL, NULL
+            FROM chopchop.secondhand_product
+            WHERE sp_id = %s
+        """)
+        await cursor.execute(query, (product_id, product_id), prepare=PREPARE)
+        response = await cursor.fetchone()
+
+        if response is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+
+        match response[0]:
             case "verified":
                 from model.product.verified import VerifiedProduct
 
-                product = VerifiedProduct(_id=product_id)
-                return product
+                product = VerifiedProduct.from_row(response[1:])
 
             case "secondhand":
                 from model.product.secondhand import SecondhandProduct
 
-                return SecondhandProduct(_id=product_id)
-
-            case "not found":
-                raise HTTPException(
-                    status_code=404, detail="Product not found")
+                product = SecondhandProduct.from_row(response[1:])
 
             case _:
                 raise HTTPException(
                     status_code=500,
-                    detail="Something unexpected happened at model/product.py:Product.into_child:78",
+                    detail="Something unexpected happened at model/product.py:Product.factory",
                 )
 
+        product_cache.set(product_id, (type(product), product.model_dump()))
+        return product
+
+    # Product.factory on its own pooled connection. Lookups of the same product
+    # made while one is running wait for it instead of running it again
+    @staticmethod
+    async def fetch(product_id: UUID):
+        cached = product_cache.get(product_id)
+        if cached is not None:
+            product_type, data = cached
+            return product_type.model_construct(**data)
+
+        async def load():
+            async with get_read_connection(("product", product_id)) as conn:
+                async with conn.cursor() as cursor:
+                    return await Product.factory(cursor, product_id)
+
+        try:
+            return await product_flight.do(product_id, load)
+
+        except TimeoutError:
+            raise HTTPException(
+                status_code=504, detail="Timed out waiting for the database")
+
+    # Products by id, in the order requested, and the ids that don't exist.
+    # Products that aren't cached are loaded with one query per product table
     @staticmethod
-    def get_products(
-        cursor: Cursor,
+    async def fetch_many(product_ids: list[UUID]):
+        products = {}
+        for product_id in product_ids:
+            cached = product_cache.get(product_id)
+            if cached is not None:
+                product_type, data = cached
+                products[product_id] = product_type.model_construct(**data)
+
+        uncached = [
+            product_id for product_id in product_ids if product_id not in products]
+        if uncached:
+            from model.product.verified import VerifiedProduct
+            from model.product.secondhand import SecondhandProduct
+
+            verified_query = sql.SQL("""
+                SELECT vp_id, vp_owner, vp_name, vp_description, vp_price, vp_image, vp_category, vp_sku, vp_stock, vp_sold
+                FROM chopchop.verified_product
+                WHERE vp_id = ANY(%s::uuid[])
+            """)
+            secondhand_query = sql.SQL("""
+                SELECT sp_id, sp_owner, sp_name, sp_description, sp_price, sp_image, sp_category
+                FROM chopchop.secondhand_product
+                WHERE sp_id = ANY(%s::uuid[])
+            """)
+
+            async with get_read_connection(*(("product", product_id) for product_id in uncached)) as conn:
+                async with conn.cursor() as cursor:
+                    for product_type, query in (
+                        (VerifiedProduct, verified_query),
+                        (SecondhandProduct, secondhand_query),
+                    ):
+                        await cursor.execute(query, (uncached,), prepare=PREPARE)
+                        for row in await cursor.fetchall():
+                            product = product_type.from_row(row)
+                            product_cache.set(
+                                product.id, (product_type, product.model_dump()))
+                            products[product.id] = product
+
+        return {
+            "products": [products[product_id] for product_id in product_ids if product_id in products],
+            "missing": [product_id for product_id in product_ids if product_id not in products],
+        }
+
+    @staticmethod
+    def default_sort(query: Optional[str], sort: Optional[Sort]):
+        # Searches are sorted by relevance unless asked otherwise, which
+        # only makes sense when there is something to search for
+        if sort is None or (sort == Product.Sort.RELEVANCE and not query):
+            return Product.Sort.RELEVANCE if query else Product.Sort.NEWEST
+
+        return sort
+
+    @staticmethod
+    async def get_products(
+        cursor: AsyncCursor,
         query: Optional[str],
         page: int,
         category: Optional[Category],
         price_min: float,
         price_max: float,
+        sort: Optional[Sort] = None,
+        page_cursor: Optional[str] = None,
     ):
-        sql_query = """
-            WITH products AS (
-                SELECT vp_id AS id, vp_name AS name, vp_image AS image, vp_price AS price, vp_category AS category
-                FROM chopchop.verified_product
-
-                UNION
+        sort = Product.default_sort(query, sort)
 
-                SELECT sp_id AS id, sp_name AS name, sp_image AS image, sp_price as PRICE, sp_category AS category
-                FROM chopchop.secondhand_product
-            )
-            SELECT id, name, image, price FROM products
+        sql_query = """
+            SELECT pc_id, pc_type, pc_name, pc_image, pc_price, pc_created_at, {relevance} AS relevance
+            FROM chopchop.product_catalog
         """
         sql_query_parameters = []
         conditions = []
+        order_by, after = SORT_KEYS[sort]
 
         # ============== Add filters =============== #
         if query:
-            conditions.append("name ILIKE %s")
-            sql_query_parameters.append(query)
+            sql_query = sql_query.format(relevance=SEARCH_RELEVANCE)
+            sql_query += ", " + SEARCH_TERMS
+            sql_query_parameters.extend([query, query, query])
+            # Full-text match on the name and description, or a fuzzy match on the name to tolerate typos
+            conditions.append("(pc_search @@ tsquery OR term <%% pc_name)")
+
+        else:
+            sql_query = sql_query.format(relevance="NULL::float8")
 
         if category:
-            conditions.append("category = %s")
-            sql_query_parameters.append(category)
+            conditions.append("pc_category = %s")
+            sql_query_parameters.append(category.value)
 
-        conditions.append("""
-            price BETWEEN %s AND %s
-            LIMIT %s OFFSET %s
-        """)
-        sql_query_parameters.extend(
-            [price_min, price_max, PRODUCTS_PER_PAGE, page * PRODUCTS_PER_PAGE]
-        )
+        conditions.append("pc_price BETWEEN %s::numeric AND %s::numeric")
+        sql_query_parameters.extend([price_min, price_max])
+
+        # Continue after the last row seen, or fall back to the page offset
+        offset = page * PRODUCTS_PER_PAGE
+        if page_cursor:
+            conditions.append(after)
+            sql_query_parameters.extend(decode_cursor(sort, page_cursor))
+            offset = 0
 
         sql_query += " WHERE " + " AND ".join(conditions)
+        sql_query += f" ORDER BY {order_by} LIMIT %s OFFSET %s"
+        sql_query_parameters.extend([PRODUCTS_PER_PAGE + 1, offset])
         # ========================================== #
 
-        cursor.execute(sql_query, sql_query_parameters)
-        results = cursor.fetchall()
+        # The best plan for a search depends on how common its terms are, a
+        # generic plan from psycopg's automatic prepare is up to 10x slower
+        await cursor.execute(
+            sql_query, sql_query_parameters, prepare=False if query else None)
+        results = await cursor.fetchall()
+
+        next_cursor = None
+        if len(results) > PRODUCTS_PER_PAGE:
+            results = results[:PRODUCTS_PER_PAGE]
+            next_cursor = encode_cursor(sort, results[-1])
 
         def to_dict(result):
             return {
                 "id": result[0],
-                "name": result[1],
-                "image": result[2],
-                "price": result[3]
+                "type": result[1],
+                "name": result[2],
+                "image": result[3],
+                "price": result[4]
             }
 
         products = list(map(to_dict, results))
-        return products
+        return {"products": products, "next_cursor": next_cursor}
+
+    # Matching products per category and per price bucket, and their total.
+    # Each facet ignores its own filter, so the other categories and prices can
+    # still be offered
+    @staticmethod
+    async def get_facets(
+        cursor: AsyncCursor,
+        query: Optional[str],
+        category: Optional[Category],
+        price_min: float,
+        price_max: float,
+    ):
+        if query:
+            return await Product.search_facets(cursor, query, category, price_min, price_max)
+        return await Product.count_facets(cursor, category, price_min, price_max)
+
+    # Without search terms the facets are summed from the counts kept by the
+    # catalog triggers, see sql/migrations/0013_catalog_price_counts.sql. The
+    # buckets inside the price filter are counted whole, the prices of the
+    # buckets it cuts are read one by one
+    @staticmethod
+    async def count_facets(
+        cursor: AsyncCursor,
+        category: Optional[Category],
+        price_min: float,
+        price_max: float,
+    ):
+        await cursor.execute("""
+            SELECT cbc_category, cbc_min, cbc_count
+            FROM chopchop.catalog_bucket_count
+            WHERE cbc_count <> 0
+        """)
+        buckets = await cursor.fetchall()
+
+        # Buckets inside [price_min, price_max], they are contiguous
+        inside = [
+            (bucket_min, bucket_max)
+            for bucket_min, bucket_max in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + [float("inf")])
+            if bucket_min >= price_min and bucket_max <= price_max
+        ]
+
+        facets = {"total": 0, "categories": {}, "price": []}
+        histogram = {}
+        for bucket_category, bucket_min, count in buckets:
+            if inside and inside[0][0] <= bucket_min < inside[-1][1]:
+                categories = facets["categories"]
+                categories[bucket_category] = categories.get(
+                    bucket_category, 0) + count
+            if bucket_min >= 0 and (not category or bucket_category == category.value):
+                histogram[bucket_min] = histogram.get(bucket_min, 0) + count
+
+        if inside:
+            sql_query = """
+                SELECT cpc_category, sum(cpc_count)
+                FROM chopchop.catalog_price_count
+                WHERE cpc_price >= %s::numeric AND cpc_price < %s::numeric
+                    OR cpc_price >= %s::numeric AND cpc_price <= %s::numeric
+                GROUP BY 1
+            """
+            sql_query_parameters = [price_min,
+                                    inside[0][0], inside[-1][1], price_max]
+        else:
+            sql_query = """
+                SELECT cpc_category, sum(cpc_count)
+                FROM chopchop.catalog_price_count
+                WHERE cpc_price BETWEEN %s::numeric AND %s::numeric
+                GROUP BY 1
+            """
+            sql_query_parameters = [price_min, price_max]
+
+        await cursor.execute(sql_query, sql_query_parameters)
+        for price_category, count in await cursor.fetchall():
+            categories = facets["categories"]
+            categories[price_category] = categories.get(
+                price_category, 0) + count
+
+        facets["categories"] = {
+            name: count for name, count in facets["categories"].items() if count}
+        if category:
+            facets["total"] = facets["categories"].get(category.value, 0)
+        else:
+            facets["total"] = sum(facets["categories"].values())
+
+        for bucket_min in sorted(histogram):
+            if not histogram[bucket_min]:
+                continue
+            bucket = PRICE_BUCKETS.index(bucket_min)
+            facets["price"].append({
+                "min": PRICE_BUCKETS[bucket],
+                "max": PRICE_BUCKETS[bucket + 1] if bucket + 1 < len(PRICE_BUCKETS) else None,
+                "count": histogram[bucket_min],
+            })
+
+        return facets
+
+    # With search terms the facets are counted in one pass over the matches
+    @staticmethod
+    async def search_facets(
+        cursor: AsyncCursor,
+        query: str,
+        category: Optional[Category],
+        price_min: float,
+        price_max: float,
+    ):
+        sql_query = """
+            SELECT
+                category,
+                bucket,
+                count(*) FILTER (WHERE price_ok),
+                count(*) FILTER (WHERE category_ok),
+                count(*) FILTER (WHERE price_ok AND category_ok),
+                GROUPING(category, bucket)
+            FROM (
+                SELECT
+                    pc_category AS category,
+                    width_bucket(pc_price, %s::numeric[]) AS bucket,
+                    pc_price BETWEEN %s::numeric AND %s::numeric AS price_ok,
+                    {category_ok} AS category_ok
+                FROM chopchop.product_catalog
+                {search}
+            ) AS matches
+            GROUP BY GROUPING SETS ((category), (bucket), ())
+        """
+        sql_query_parameters = [PRICE_BUCKETS, price_min, price_max]
+
+        if category:
+            category_ok = "pc_category = %s"
+            sql_query_parameters.append(category.value)
+        else:
+            category_ok = "true"
+
+        search = ", " + SEARCH_TERMS + \
+            " WHERE (pc_search @@ tsquery OR term <%% pc_name)"
+        sql_query_parameters.extend([query, query, query])
+
+        sql_query = sql_query.format(category_ok=category_ok, search=search)
+        await cursor.execute(sql_query, sql_query_parameters, prepare=False)
+
+        facets = {"total": 0, "categories": {}, "price": []}
+        for category, bucket, in_price, in_category, in_both, grouping in await cursor.fetchall():
+            match grouping:
+                # Grouped by category
+                case 1:
+                    if in_price:
+                        facets["categories"][category] = in_price
+
+                # Grouped by price bucket, numbered from 1, 0 is below the first
+                case 2:
+                    if in_category and bucket > 0:
+                        facets["price"].append({
+                            "min": PRICE_BUCKETS[bucket - 1],
+                            "max": PRICE_BUCKETS[bucket] if bucket < len(PRICE_BUCKETS) else None,
+                            "count": in_category,
+                        })
+
+                case 3:
+                    facets["total"] = in_both
+
+        facets["price"].sort(key=lambda price_bucket: price_bucket["min"])
+        return facets
+
+
+# Lower bounds of the price histogram buckets, the last one is open ended.
+# Must match chopchop.price_bucket in sql/migrations/0013_catalog_price_counts.sql
+PRICE_BUCKETS = [0, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# The search terms are parsed once with both stemmers, the tsquery matches
+# either language. See sql/migrations/0003_product_search.sql for the indexes
+SEARCH_TERMS = """
+    (
+        SELECT
+            websearch_to_tsquery('chopchop.catalan', %s) || websearch_to_tsquery('spanish', %s) AS tsquery,
+            %s::text AS term
+    ) AS search
+"""
+SEARCH_RELEVANCE = "(ts_rank(pc_search, tsquery) + word_similarity(term, pc_name))::float8"
+
+# ORDER BY clause and keyset condition of each sort order. The id breaks ties
+# so the order is total and no row is skipped or repeated between pages
+SORT_KEYS = {
+    Product.Sort.RELEVANCE: (
+        "relevance DESC, pc_id DESC", f"({SEARCH_RELEVANCE}, pc_id) < (%s, %s)"
+    ),
+    Product.Sort.NEWEST: (
+        "pc_created_at DESC, pc_id DESC", "(pc_created_at, pc_id) < (%s, %s)"
+    ),
+    Product.Sort.PRICE_ASC: (
+        "pc_price ASC, pc_id ASC", "(pc_price, pc_id) > (%s, %s)"
+    ),
+    Product.Sort.PRICE_DESC: (
+        "pc_price DESC, pc_id DESC", "(pc_price, pc_id) < (%s, %s)"
+    ),
+}
+
+# Column of the sort key in the rows returned by get_products
+# (id, type, name, image, price, created_at, relevance), and its parser
+CURSOR_KEYS = {
+    Product.Sort.RELEVANCE: (6, float),
+    Product.Sort.NEWEST: (5, datetime.fromisoformat),
+    Product.Sort.PRICE_ASC: (4, Decimal),
+    Product.Sort.PRICE_DESC: (4, Decimal),
+}
+
+
+def encode_cursor(sort: Product.Sort, row) -> str:
+    column, _ = CURSOR_KEYS[sort]
+    key = row[column]
+    key = key.isoformat() if isinstance(key, datetime) else repr(
+        key) if isinstance(key, float) else str(key)
+
+    return encode_page_cursor(sort.value, key, str(row[0]))
+
+
+def decode_cursor(sort: Product.Sort, page_cursor: str):
+    def parse(cursor_sort, key, id_):
+        if cursor_sort != sort.value:
+            raise ValueError("Cursor sort order mismatch")
+
+        _, parse_key = CURSOR_KEYS[sort]
+        return parse_key(key), UUID(id_)
+
+    return decode_page_cursor(page_cursor, parse)
 
 
 # Used to seralize the recieved json for the POST request on /product
@@ -1,33 +1,26 @@
-from uuid import UUID
-
-from psycopg import Cursor, sql
+from psycopg import AsyncCursor, sql
 from fastapi import HTTPException
 
+from database import note_write
 from model.user import User, Particular, Professional, Admin
-from model.product.product import Product
+from model.product.product import Product, product_cache
 
 
 class SecondhandProduct(Product):
-    def fetch(self, cursor: Cursor, product_id: UUID):
-        query_secondhand = sql.SQL(
-            """
-            SELECT sp_id, sp_owner, sp_name, sp_description, sp_price, sp_image, sp_category
-            FROM chopchop.secondhand_product
-            WHERE sp_id = %s;
-            """
+    # Row layout: id, owner, name, description, price, image, category
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            id=row[0],
+            owner=row[1],
+            name=row[2],
+            description=row[3],
+            price=float(row[4]),
+            image=row[5],
+            category=cls.Category(row[6]),
         )
-        cursor.execute(query_secondhand, (product_id,))
-        response = cursor.fetchone()
-
-        self.id = UUID(response[0])
-        self.owner = UUID(response[1])
-        self.name = response[2]
-        self.description = response[3]
-        self.price = float(response[4])
-        self.image = response[5]
-        self.category = self.Category(response[6])
 
-    def insert(self, cursor: Cursor, user: User):
+    async def insert(self, cursor: AsyncCursor, user: User):
         if not (isinstance(user, Particular) or isinstance(user, Professional)):
             raise Exception(
                 "This user is not allowed to post verified products")
@@ -36,8 +29,8 @@ class SecondhandProduct(Product):
             INSERT INTO chopchop.product_id DEFAULT VALUES
             RETURNING product_id
         """)
-        cursor.execute(insert_product_query)
-        product_id = cursor.fetchone()[0]
+        await cursor.execute(insert_product_query)
+        product_id = (await cursor.fetchone())[0]
 
         insert_secondhand_query = sql.SQL("""
             INSERT INTO chopchop.secondhand_product (
@@ -51,7 +44,7 @@ class SecondhandProduct(Product):
             )
             VALUES (%s, %s, %s, %s, %s, %s, %s)
         """)
-        cursor.execute(
+        await cursor.execute(
             insert_secondhand_query,
             (
                 product_id,
@@ -64,25 +57,27 @@ class SecondhandProduct(Product):
             ),
         )
 
+        note_write(("product", product_id))
         return product_id
 
-    def delete(self, cursor: Cursor, user: User):
+    async def delete(self, cursor: AsyncCursor, user: User):
         query = "DELETE FROM chopchop.secondhand_product WHERE sp_id = %s AND sp_owner = %s RETURNING 'success'"
+        parameters = (self.id, user.id)
         if isinstance(user, Admin):
             query = (  # If tne user is an admin, skip product owner check
                 "DELETE FROM chopchop.secondhand_product WHERE sp_id = %s RETURNING 'success'"
             )
+            parameters = (self.id,)
 
-        cursor.execute(
-            sql.SQL(query),
-            (self.id, user.id),
-        )
-        response = cursor.fetchone()
+        await cursor.execute(sql.SQL(query), parameters)
+        response = await cursor.fetchone()
+        product_cache.delete(self.id)
+        note_write(("product", self.id))
 
-        if response != "success":
+        if response is None:
             raise HTTPException(status_code=404, detail="Product not found")
 
-    def update(self, cursor: Cursor, user: User):
+    async def update(self, cursor: AsyncCursor, user: User):
         update_secondhand_query = sql.SQL("""
             UPDATE chopchop.secondhand_product
             SET  
@@ -94,7 +89,7 @@ class SecondhandProduct(Product):
             WHERE sp_id = %s AND sp_owner = %s
             RETURNING 'success'
         """)
-        cursor.execute(
+        await cursor.execute(
             update_secondhand_query,
             (
                 self.name,
@@ -102,11 +97,13 @@ class SecondhandProduct(Product):
                 self.price,
                 self.image,
                 self.category.value,
-                self.sp_id,
+                self.id,
                 user.id,
             ),
         )
-        response = cursor.fetchone()
+        response = await cursor.fetchone()
+        product_cache.delete(self.id)
+        note_write(("product", self.id))
 
-        if response != "success":
+        if response is None:
             raise HTTPException(status_code=404, detail="Product not found")
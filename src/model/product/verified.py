@@ -1,10 +1,9 @@
-from uuid import UUID
-
-from psycopg import Cursor, sql
+from psycopg import AsyncCursor, sql
 from fastapi import HTTPException
 
+from database import note_write
 from model.user import User, Professional, Enterprise, Admin
-from model.product.product import Product
+from model.product.product import Product, product_cache
 
 
 class VerifiedProduct(Product):
@@ -12,30 +11,23 @@ class VerifiedProduct(Product):
     stock: int = 0
     sold: int = 0
 
-    def fetch(self, cursor: Cursor, product_id: UUID):
-        query_verified = sql.SQL(
-            """
-            SELECT vp_id, vp_owner, vp_sku, vp_name, vp_description, vp_stock, vp_price, vp_image, vp_category, vp_sold
-            FROM chopchop.verified_product
-            WHERE vp_id = %s;
-            """
+    # Row layout: id, owner, name, description, price, image, category, sku, stock, sold
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            id=row[0],
+            owner=row[1],
+            name=row[2],
+            description=row[3],
+            price=float(row[4]),
+            image=row[5],
+            category=cls.Category(row[6]),
+            sku=row[7],
+            stock=int(row[8]),
+            sold=int(row[9]),
         )
-        cursor.execute(query_verified, (product_id,))
-
-        response = cursor.fetchone()
-
-        self.id = response[0]
-        self.owner = response[1]
-        self.sku = response[2]
-        self.name = response[3]
-        self.description = response[4]
-        self.stock = int(response[5])
-        self.price = float(response[6])
-        self.image = response[7]
-        self.category = self.Category(response[8])
-        self.sold = response[9]
 
-    def insert(self, cursor: Cursor, user: User):
+    async def insert(self, cursor: AsyncCursor, user: User):
         if not (isinstance(user, Professional) or isinstance(user, Enterprise)):
             raise Exception(
                 "This user is not allowed to post verified products")
@@ -44,8 +36,8 @@ class VerifiedProduct(Product):
             INSERT INTO chopchop.product_id DEFAULT VALUES
             RETURNING product_id
         """)
-        cursor.execute(insert_product_query)
-        product_id = cursor.fetchone()[0]
+        await cursor.execute(insert_product_query)
+        product_id = (await cursor.fetchone())[0]
 
         insert_verified_query = sql.SQL("""
             INSERT INTO chopchop.verified_product (
@@ -62,7 +54,7 @@ class VerifiedProduct(Product):
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """)
 
-        cursor.execute(
+        await cursor.execute(
             insert_verified_query,
             (
                 product_id,
@@ -77,25 +69,27 @@ class VerifiedProduct(Product):
             ),
         )
 
+        note_write(("product", product_id))
         return product_id
 
-    def delete(self, cursor: Cursor, user: User):
+    async def delete(self, cursor: AsyncCursor, user: User):
         query = "DELETE FROM chopchop.verified_product WHERE vp_id = %s AND vp_owner = %s RETURNING 'success'"
+        parameters = (self.id, user.id)
         if isinstance(user, Admin):
             query = (  # If tne user is an admin, skip product owner check
                 "DELETE FROM chopchop.verified_product WHERE vp_id = %s RETURNING 'success'"
             )
+            parameters = (self.id,)
 
-        cursor.execute(
-            sql.SQL(query),
-            (self.id, user.id),
-        )
-        response = cursor.fetchone()
+        await cursor.execute(sql.SQL(query), parameters)
+        response = await cursor.fetchone()
+        product_cache.delete(self.id)
+        note_write(("product", self.id))
 
-        if response != "success":
+        if response is None:
             raise HTTPException(status_code=404, detail="Product not found")
 
-    def update(self, cursor: Cursor, user: User):
+    async def update(self, cursor: AsyncCursor, user: User):
         update_verified_query = sql.SQL("""
             UPDATE chopchop.verified_product
             SET 
@@ -109,7 +103,7 @@ class VerifiedProduct(Product):
             RETURNING 'success'
         """)
 
-        cursor.execute(
+        await cursor.execute(
             update_verified_query,
             (
                 self.name,
@@ -118,13 +112,13 @@ class VerifiedProduct(Product):
                 self.price,
                 self.image,
                 self.category.value,
-                self.vp_id,
+                self.id,
                 user.id,
             ),
         )
-        response = cursor.fetchone()
+        response = await cursor.fetchone()
+        product_cache.delete(self.id)
+        note_write(("product", self.id))
 
-        if response != "success":
-            raise Exception(
-                "This user is not allowed to post verified products")
+        if response is None:
             raise HTTPException(status_code=404, detail="Product not found")
@@ -2,10 +2,14 @@ from datetime import datetime
 from typing import List, Optional
 from uuid import UUID
 
-from pydantic import BaseModel
-from psycopg import sql, Cursor
+from pydantic import BaseModel, Field
+from psycopg import sql, AsyncCursor
+from fastapi import HTTPException
 
+from database import PREPARE, note_write
 from model.user import User, Particular, Professional
+from model.product.product import product_cache
+from pagination import decode_page_cursor, encode_page_cursor
 
 
 class Purchase(BaseModel):
@@ -16,13 +20,10 @@ class Purchase(BaseModel):
     # Associative class between purchase and product_id
     class PurchaseItem(BaseModel):
         product_id: UUID
-        count: int
-        paid: float
-
-        def __init__(self, product_id: UUID, count: int, paid: float):
-            self.product_id = product_id
-            self.count = count
-            self.paid = paid
+        # A negative count would give stock back to the seller and take away sales
+        count: int = Field(gt=0)
+        # For the whole item, count included
+        paid: float = Field(ge=0)
 
     items: List[PurchaseItem] = []
 
@@ -30,9 +31,9 @@ class Purchase(BaseModel):
         if not (isinstance(user, Particular) or isinstance(user, Professional)):
             raise Exception("This user is not allowed to make purchases")
 
-        self.user_id = user.id
+        super().__init__(user_id=user.id)
 
-    def fetch(self, cursor: Cursor, purchase_id: UUID):
+    async def fetch(self, cursor: AsyncCursor, purchase_id: UUID):
         query_purchase = sql.SQL(
             """
             SELECT pu_date
@@ -40,12 +41,15 @@ class Purchase(BaseModel):
             WHERE pu_id = %s AND pu_user_id = %s;
             """
         )
-        cursor.execute(query_purchase, (purchase_id, self.user_id))
+        await cursor.execute(query_purchase, (purchase_id, self.user_id), prepare=PREPARE)
+
+        response = await cursor.fetchone()
 
-        response = cursor.fetchone()
+        if response is None:
+            raise HTTPException(status_code=404, detail="Purchase not found")
 
         self.id = purchase_id
-        self.date = datetime.datetime.fromisoformat(response[1])
+        self.date = response[0]
 
         query_purchased_items = sql.SQL(
             """
@@ -54,51 +58,164 @@ class Purchase(BaseModel):
             WHERE pi_purchase_id = %s;
             """
         )
-        cursor.execute(query_purchased_items, (purchase_id,))
+        await cursor.execute(query_purchased_items, (purchase_id,), prepare=PREPARE)
 
-        response = cursor.fetchall()
+        response = await cursor.fetchall()
 
         for item in response:
             product_id = item[0]
             count = int(item[1])
             paid = float(item[2])
 
-            item = self.PurchaseItem(product_id, count, paid)
+            item = self.PurchaseItem(
+                product_id=product_id, count=count, paid=paid)
 
             self.items.append(item)
 
         return self
 
-    def insert(self, cursor: Cursor, purchased_items: List[PurchaseItem]):
-        insert_product_query = sql.SQL("""
-            INSERT INTO chopchop.purchase (pu_user_id)
-            VALUES (%s)
-            RETURNING pu_id
-        """)
-        cursor.execute(insert_product_query, (self.user_id,))
-        purchase_id = cursor.fetchone()[0]
+    async def insert(self, cursor: AsyncCursor, purchased_items: List[PurchaseItem]):
+        if not purchased_items:
+            raise HTTPException(
+                status_code=400, detail="A purchase needs at least one item")
 
-        insert_purchase = sql.SQL("""
-            INSERT INTO chopchop.purchase_item (
-                pi_purchase_id,
-                pi_product_id,
-                pi_count,
-                pi_paid,
+        # Also checked here for items that weren't validated, like model_construct()
+        if any(item.count <= 0 or item.paid < 0 for item in purchased_items):
+            raise HTTPException(
+                status_code=400, detail="Items need a positive count and a non negative price")
+
+        # Merge repeated products and sort them by id, stock rows are locked in
+        # this order so concurrent purchases can't deadlock each other
+        merged = {}
+        for item in purchased_items:
+            count, paid = merged.get(item.product_id, (0, 0.0))
+            merged[item.product_id] = (count + item.count, paid + item.paid)
+
+        product_ids = sorted(merged)
+        counts = [merged[product_id][0] for product_id in product_ids]
+        paid = [merged[product_id][1] for product_id in product_ids]
+
+        # Reserve the stock of the verified products, returns the ones that
+        # don't have enough left. Secondhand products have no stock
+        reserve_stock_query = sql.SQL("""
+            WITH requested AS (
+                SELECT * FROM unnest(%s::uuid[], %s::int[]) AS r(product_id, count)
+            ),
+            locked AS (
+                SELECT vp_id, vp_stock
+                FROM chopchop.verified_product
+                WHERE vp_id IN (SELECT product_id FROM requested)
+                ORDER BY vp_id
+                FOR UPDATE
+            ),
+            reserved AS (
+                UPDATE chopchop.verified_product vp
+                SET
+                    vp_stock = vp.vp_stock - requested.count,
+                    vp_sold = vp.vp_sold + requested.count
+                FROM locked
+                JOIN requested ON requested.product_id = locked.vp_id
+                WHERE vp.vp_id = locked.vp_id AND locked.vp_stock >= requested.count
+                RETURNING vp.vp_id
             )
-            VALUES (%s, %s, %s, %s)
+            SELECT vp_id FROM locked
+            WHERE vp_id NOT IN (SELECT vp_id FROM reserved)
         """)
+        await cursor.execute(reserve_stock_query, (product_ids, counts), prepare=PREPARE)
+        out_of_stock = await cursor.fetchall()
 
-        for item in purchased_items:
-            cursor.execute(
-                insert_purchase,
-                (
-                    purchase_id,
-                    item.product_id,
-                    item.count,
-                    item.paid,
-                ),
+        # Stock and sold counters changed
+        for product_id in product_ids:
+            product_cache.delete(product_id)
+        note_write(("user", self.user_id), *(("product", product_id)
+                   for product_id in product_ids))
+
+        if out_of_stock:
+            product_ids = ", ".join(str(row[0]) for row in out_of_stock)
+            raise HTTPException(
+                status_code=409, detail=f"Not enough stock for products: {product_ids}")
+
+        insert_purchase = sql.SQL("""
+            WITH purchase AS (
+                INSERT INTO chopchop.purchase (pu_user_id)
+                VALUES (%s)
+                RETURNING pu_id
+            ),
+            items AS (
+                INSERT INTO chopchop.purchase_item (
+                    pi_purchase_id,
+                    pi_product_id,
+                    pi_count,
+                    pi_paid
+                )
+                SELECT pu_id, item.product_id, item.count, item.paid
+                FROM purchase, unnest(%s::uuid[], %s::int[], %s::float8[]) AS item(product_id, count, paid)
             )
+            SELECT pu_id FROM purchase
+        """)
+        await cursor.execute(
+            insert_purchase, (self.user_id, product_ids, counts, paid), prepare=PREPARE)
+        purchase_id = (await cursor.fetchone())[0]
 
         return purchase_id
 
+    # A page of the user's purchases, newest first, with their items and a
+    # summary of each product. The page is picked from the index on
+    # (pu_user_id, pu_date, pu_id) and its items are joined in the same query
+    async def history(self, cursor: AsyncCursor, limit: int, page_cursor: Optional[str] = None):
+        conditions = ["pu_user_id = %s"]
+        parameters = [self.user_id]
+        if page_cursor:
+            conditions.append("(pu_date, pu_id) < (%s, %s)")
+            parameters.extend(decode_history_cursor(page_cursor))
+        parameters.append(limit + 1)
+
+        query = sql.SQL("""
+            WITH page AS (
+                SELECT pu_id, pu_date
+                FROM chopchop.purchase
+                WHERE {conditions}
+                ORDER BY pu_date DESC, pu_id DESC
+                LIMIT %s
+            )
+            SELECT pu_id, pu_date, pi_product_id, pi_count, pi_paid, pc_type, pc_name, pc_image
+            FROM page
+            LEFT JOIN chopchop.purchase_item ON pi_purchase_id = pu_id
+            LEFT JOIN chopchop.product_catalog ON pc_id = pi_product_id
+            ORDER BY pu_date DESC, pu_id DESC, pi_product_id
+        """).format(conditions=sql.SQL(" AND ").join(map(sql.SQL, conditions)))
+        await cursor.execute(query, parameters, prepare=PREPARE)
+
+        purchases = {}
+        for purchase_id, date, product_id, count, paid, product_type, name, image in await cursor.fetchall():
+            purchase = purchases.setdefault(
+                purchase_id, {"id": purchase_id, "date": date, "items": []})
+            if product_id is None:
+                continue
+
+            purchase["items"].append({
+                "product_id": product_id,
+                "count": int(count),
+                "paid": float(paid),
+                "type": product_type,
+                "name": name,
+                "image": image,
+            })
+
+        purchases = list(purchases.values())
+        next_cursor = None
+        if len(purchases) > limit:
+            purchases = purchases[:limit]
+            next_cursor = encode_history_cursor(purchases[-1])
+
+        return {"purchases": purchases, "next_cursor": next_cursor}
+
     # No delete or update methods, purchases are final!
+
+
+def encode_history_cursor(purchase) -> str:
+    return encode_page_cursor(purchase["date"].isoformat(), str(purchase["id"]))
+
+
+def decode_history_cursor(page_cursor: str):
+    return decode_page_cursor(page_cursor, lambda date, id_: (datetime.fromisoformat(date), UUID(id_)))
@@ -0,0 +1,86 @@
+from datetime import date
+from enum import Enum
+
+from fastapi import HTTPException
+from psycopg import AsyncCursor, sql
+
+from model.user import User, Professional, Enterprise
+
+
+class Sales:
+    """Revenue and units sold by a seller, read from the daily rollup kept by the purchase_item trigger"""
+
+    class Granularity(Enum):
+        DAY = "day"
+        WEEK = "week"
+        MONTH = "month"
+
+    @staticmethod
+    async def get_report(
+        cursor: AsyncCursor,
+        user: User,
+        start: date,
+        end: date,
+        granularity: Granularity,
+        top: int,
+    ):
+        if not (isinstance(user, Professional) or isinstance(user, Enterprise)):
+            raise HTTPException(
+                status_code=403, detail="Only professional and enterprise users have sales reports")
+
+        if start > end:
+            raise HTTPException(
+                status_code=400, detail="The start of the period is after its end")
+
+        # Both ends included, periods are aligned to the start of the week or month
+        series_query = sql.SQL("""
+            SELECT date_trunc({granularity}, sds_day::timestamp)::date AS period, sum(sds_units), sum(sds_revenue)
+            FROM chopchop.seller_daily_sales
+            WHERE sds_seller = %s AND sds_day BETWEEN %s AND %s
+            GROUP BY period
+            ORDER BY period
+        """).format(granularity=sql.Literal(granularity.value))
+        await cursor.execute(series_query, (user.id, start, end))
+
+        series = [
+            {"period": period, "units": int(units), "revenue": float(revenue)}
+            for period, units, revenue in await cursor.fetchall()
+        ]
+
+        top_query = sql.SQL("""
+            WITH totals AS (
+                SELECT sds_product, sum(sds_units) AS units, sum(sds_revenue) AS revenue
+                FROM chopchop.seller_daily_sales
+                WHERE sds_seller = %s AND sds_day BETWEEN %s AND %s
+                GROUP BY sds_product
+                ORDER BY revenue DESC, units DESC, sds_product
+                LIMIT %s
+            )
+            SELECT sds_product, units, revenue, pc_type, pc_name, pc_image
+            FROM totals
+            LEFT JOIN chopchop.product_catalog ON pc_id = sds_product
+            ORDER BY revenue DESC, units DESC, sds_product
+        """)
+        await cursor.execute(top_query, (user.id, start, end, top))
+
+        top_products = [
+            {
+                "product_id": product_id,
+                "units": int(units),
+                "revenue": float(revenue),
+                "type": product_type,
+                "name": name,
+                "image": image,
+            }
+            for product_id, units, revenue, product_type, name, image in await cursor.fetchall()
+        ]
+
+        return {
+            "start": start,
+            "end": end,
+            "granularity": granularity.value,
+            "units": sum(point["units"] for point in series),
+            "revenue": round(sum(point["revenue"] for point in series), 2),
+            "series": series,
+            "top_products": top_products,
+        }
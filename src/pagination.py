@@ -0,0 +1,24 @@
+import base64
+import json
+from typing import Callable, TypeVar
+
+from fastapi import HTTPException
+
+T = TypeVar("T")
+
+
+# Cursors are an opaque base64 encoding of a JSON list, the sort key and id of
+# the last row of the page
+def encode_page_cursor(*keys) -> str:
+    payload = json.dumps(list(keys))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_page_cursor(page_cursor: str, parse: Callable[..., T]) -> T:
+    """The keys of the cursor passed to `parse`, cursors that can't be decoded or parsed answer 400"""
+    try:
+        payload = base64.urlsafe_b64decode(page_cursor.encode()).decode()
+        return parse(*json.loads(payload))
+
+    except (ValueError, TypeError, ArithmeticError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
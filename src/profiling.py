@@ -0,0 +1,194 @@
+import functools
+import hmac
+import inspect
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from uuid import uuid4
+
+from fastapi.routing import APIRoute
+from psycopg import AsyncCursor, sql
+
+logger = logging.getLogger(__name__)
+
+# Log every statement with its parameters, duration and row count
+QUERY_LOG = os.getenv("QUERY_LOG", "0") == "1"
+
+# Statements slower than this are logged with their plan, 0 disables it.
+# Only read-only statements are explained with ANALYZE, which runs them again
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+# Requests with an X-Profile header holding this token get their timing
+# breakdown in a Server-Timing header. Unset disables it
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+
+READ_ONLY = re.compile(r"\s*(SELECT|WITH)\b", re.IGNORECASE)
+WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+class Profile:
+    """Request id and, when asked for, the timings of the request being answered"""
+
+    def __init__(self, request_id: str, detailed: bool):
+        self.request_id = request_id
+        self.detailed = detailed
+        self.started = time.perf_counter()
+        self.endpoint_finished: Optional[float] = None
+        self.timings: list[tuple[str, str, float]] = []
+
+    def add(self, name: str, seconds: float, description: str = ""):
+        if self.detailed:
+            self.timings.append((name, description, seconds))
+
+    def server_timing(self) -> str:
+        now = time.perf_counter()
+        timings = list(self.timings)
+        if self.endpoint_finished is not None:
+            timings.append(("serialization", "", now - self.endpoint_finished))
+        timings.append(("total", "", now - self.started))
+
+        entries = []
+        statements = 0
+        for name, description, seconds in timings:
+            entry = name
+            if name == "sql":
+                statements += 1
+                entry = f"sql-{statements}"
+            if description:
+                entry += ';desc="{}"'.format(description.replace('"', "'"))
+            entries.append(f"{entry};dur={seconds * 1000:.2f}")
+
+        return ", ".join(entries)
+
+
+current_profile: ContextVar[Optional[Profile]] = ContextVar(
+    "current_profile", default=None)
+
+
+def record(name: str, seconds: float, description: str = ""):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add(name, seconds, description)
+
+
+@contextmanager
+def span(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+async def statement_executed(cursor: AsyncCursor, name: str, query, params, seconds: float):
+    """Called by metrics.TimedCursor after every statement"""
+    profile = current_profile.get()
+    request_id = profile.request_id if profile else None
+    record("sql", seconds, f"{name} rows={cursor.rowcount}")
+
+    if QUERY_LOG:
+        logger.info(
+            "request=%s statement=%s duration=%.2fms rows=%s params=%r",
+            request_id, name, seconds * 1000, cursor.rowcount, params,
+        )
+
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        logger.warning(
+            "Slow statement request=%s statement=%s duration=%.2fms rows=%s params=%r\n%s",
+            request_id, name, seconds * 1000, cursor.rowcount, params,
+            await explain(cursor, query, params),
+        )
+
+
+async def explain(cursor: AsyncCursor, query, params) -> str:
+    conn = cursor.connection
+    query = query if isinstance(query, sql.Composable) else sql.SQL(query)
+    text = query.as_string(conn)
+    if not text.strip():
+        # The pool's health check on checkout, there is nothing to explain
+        return ""
+
+    read_only = READ_ONLY.match(text) and not WRITES.search(text)
+    options = "(ANALYZE, BUFFERS)" if read_only else ""
+
+    try:
+        # In a savepoint so a failing EXPLAIN can't abort the request's
+        # transaction, and with a plain cursor so it isn't timed itself
+        async with conn.transaction():
+            async with AsyncCursor(conn) as explain_cursor:
+                await explain_cursor.execute(
+                    sql.SQL("EXPLAIN {} ").format(sql.SQL(options)) + query, params, prepare=False)
+                return "\n".join(row[0] for row in await explain_cursor.fetchall())
+
+    except Exception as e:
+        return f"Could not explain the statement: {e}"
+
+
+class ProfiledRoute(APIRoute):
+    """Notes when the endpoint returns, what follows until the response starts is serialization"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            endpoint = timed_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def timed_endpoint(endpoint):
+    @functools.wraps(endpoint)
+    async def timed(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+
+        finally:
+            profile = current_profile.get()
+            if profile is not None:
+                profile.endpoint_finished = time.perf_counter()
+
+    return timed
+
+
+class ProfilingMiddleware:
+    """
+    Gives every request an id, taken from X-Request-ID or generated, which is
+    returned in the response and attached to the logged statements. Requests
+    with a valid X-Profile header also get a Server-Timing breakdown.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(
+            b"x-request-id", b"").decode("latin-1")[:64] or uuid4().hex
+        detailed = False
+        if PROFILE_TOKEN is not None and b"x-profile" in headers:
+            detailed = hmac.compare_digest(
+                headers[b"x-profile"], PROFILE_TOKEN.encode())
+
+        profile = Profile(request_id, detailed)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                if detailed:
+                    headers.append(
+                        (b"server-timing", profile.server_timing().encode("latin-1", "replace")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_headers)
+
+        finally:
+            current_profile.reset(token)
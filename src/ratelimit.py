@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from starlette.routing import Match
+
+from auth import verify_jwt_token
+from database import DATABASE_URL, new_pool, pool_stats
+from metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# Sustained requests per second and burst of each authenticated user, and of
+# each client address for requests without a valid token. A rate of 0
+# disables the limit. Behind a proxy every client has the proxy's address
+# unless uvicorn trusts its forwarded headers, see the README
+USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "20"))
+USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "40"))
+IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "10"))
+IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "20"))
+
+# "local" keeps the buckets in each worker, "postgres" shares them between
+# workers in chopchop.rate_limit_bucket
+BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+
+# Longest the shared backend may take before the local buckets decide instead
+BACKEND_TIMEOUT = float(
+    os.getenv("RATE_LIMIT_BACKEND_TIMEOUT", "0.05"))  # seconds
+
+# Connections of the shared backend, a pool of its own so limiting requests
+# never waits on the connections of the requests it protects
+BACKEND_POOL_SIZE = int(os.getenv("RATE_LIMIT_BACKEND_POOL_SIZE", "2"))
+
+# Scraped by Prometheus, never limited
+EXEMPT_PATHS = {"/metrics"}
+
+
+class LocalBuckets:
+    """
+    Token buckets of this worker. Only touched from the event loop, so no
+    lock is needed. The least recently used buckets are dropped beyond
+    `max_size`, they are the ones most likely to be full again anyway.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token, returns 0 or the seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+
+        return retry_after
+
+    def stats(self):
+        return {"backend": "local", "buckets": len(self._buckets)}
+
+
+class PostgresBuckets:
+    """
+    Token buckets shared by every worker, one row per key updated with a
+    single statement. When the database is slow or unreachable requests are
+    limited by the local buckets instead of waiting on it.
+    """
+
+    def __init__(self, fallback: LocalBuckets, timeout: float, pool_size: int):
+        self.fallback = fallback
+        self.timeout = timeout
+        self.fallbacks = 0
+        # Opened and closed by the FastAPI lifespan in main.py
+        self.pool = new_pool(DATABASE_URL, min_size=1, max_size=pool_size)
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        try:
+            return await asyncio.wait_for(self._take(key, rate, burst), self.timeout)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception:
+            self.fallbacks += 1
+            return await self.fallback.take(key, rate, burst)
+
+    async def _take(self, key: str, rate: float, burst: float) -> float:
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO chopchop.rate_limit_bucket AS bucket (rl_key, rl_tokens, rl_updated_at)
+                    VALUES (%(key)s, %(burst)s - 1, clock_timestamp())
+                    ON CONFLICT (rl_key) DO UPDATE SET
+                        rl_tokens = least(%(burst)s, bucket.rl_tokens
+                            + extract(epoch FROM clock_timestamp() - bucket.rl_updated_at) * %(rate)s) - 1,
+                        rl_updated_at = clock_timestamp()
+                    WHERE least(%(burst)s, bucket.rl_tokens
+                        + extract(epoch FROM clock_timestamp() - bucket.rl_updated_at) * %(rate)s) >= 1
+                    RETURNING rl_tokens
+                    """,
+                    {"key": key, "rate": rate, "burst": burst},
+                )
+                allowed = await cursor.fetchone() is not None
+
+        return 0.0 if allowed else 1 / rate
+
+    def stats(self):
+        return {
+            "backend": "postgres",
+            "fallbacks": self.fallbacks,
+            "local": self.fallback.stats(),
+            "pool": pool_stats(self.pool),
+        }
+
+
+local_buckets = LocalBuckets(
+    max_size=int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000")))
+buckets = PostgresBuckets(
+    local_buckets, BACKEND_TIMEOUT, BACKEND_POOL_SIZE) if BACKEND == "postgres" else local_buckets
+
+
+def client_key(scope) -> tuple[str, float, float]:
+    """Bucket of the request, with its rate and burst"""
+    headers = dict(scope["headers"])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+
+    if scheme.lower() == "bearer" and token:
+        try:
+            # Cached by auth, the route's own authenticate won't verify it again
+            user = verify_jwt_token(token)
+            if user is not None:
+                return f"user:{user.id}", USER_RATE, USER_BURST
+
+        # Runs before the app's exception handlers, nothing may escape. Invalid
+        # tokens are limited by address, the route answers them 401 if it
+        # needs a user
+        except (HTTPException, ValueError, TypeError):
+            pass
+
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}", IP_RATE, IP_BURST
+
+
+def matched_route(scope, routes=None):
+    """
+    Route the router would pick for the request and whether it fully matches,
+    so MetricsMiddleware labels limited requests with their route template
+    rather than as unmatched
+    """
+    partial = None
+    for route in scope["app"].router.routes if routes is None else routes:
+        match, _ = route.matches(scope)
+        if match == Match.NONE:
+            continue
+
+        # Included routers match as a whole, the route is one of theirs
+        included = getattr(route, "original_router", None)
+        if included is not None:
+            match, route = matched_route(scope, included.routes)
+
+        if match == Match.FULL:
+            return match, route
+        if match == Match.PARTIAL and partial is None:
+            partial = route
+
+    return (Match.NONE, None) if partial is None else (Match.PARTIAL, partial)
+
+
+class RateLimitMiddleware:
+    """
+    Answers 429 with a Retry-After header to clients that are over their
+    limit, before the request reaches a route and its database connection
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+
+        key, rate, burst = client_key(scope)
+        if rate <= 0:
+            return await self.app(scope, receive, send)
+
+        retry_after = await buckets.take(key, rate, burst)
+        if not retry_after:
+            return await self.app(scope, receive, send)
+
+        RATE_LIMITED.labels(key.partition(":")[0]).inc()
+        _, route = matched_route(scope)
+        if route is not None:
+            scope["route"] = route
+
+        body = json.dumps({"detail": "Too many requests"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+async def expire_rate_limit_buckets():
+    """Delete the shared buckets that have been full for a while. Runs until cancelled"""
+    while True:
+        await asyncio.sleep(600)
+        try:
+            async with buckets.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "DELETE FROM chopchop.rate_limit_bucket WHERE rl_updated_at < now() - interval '1 hour'")
+
+        except Exception as e:
+            logger.warning(
+                "Could not delete expired rate limit buckets: %s", e)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The API modules import each other from src, as they do when run from there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,41 @@
+import time
+from uuid import uuid4
+
+import jwt
+
+import cache
+from auth import ALGORITHM, SECRET_KEY, token_cache, token_digest, verify_jwt_token
+
+
+def token(**claims):
+    payload = {"sub": str(uuid4()), "type": "particular",
+               "name": "Test", "surname": "Buyer", **claims}
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def test_cached_tokens_expire_with_the_token(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: clock[0])
+
+    expiring = token(exp=int(time.time()) + 60)
+    user = verify_jwt_token(expiring)
+
+    clock[0] += 55
+    assert token_cache.get(token_digest(expiring)) == user
+
+    clock[0] += 10
+    assert token_cache.get(token_digest(expiring)) is None
+
+
+def test_tokens_without_expiration_live_the_cache_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: clock[0])
+
+    lasting = token()
+    user = verify_jwt_token(lasting)
+
+    clock[0] += token_cache.ttl - 1
+    assert token_cache.get(token_digest(lasting)) == user
+
+    clock[0] += 2
+    assert token_cache.get(token_digest(lasting)) is None
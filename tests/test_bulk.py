@@ -0,0 +1,151 @@
+import asyncio
+import contextlib
+import csv
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from model.product import bulk
+from model.product.bulk import read_csv, read_ndjson
+from model.user import Enterprise
+
+
+def read(reader, data: bytes, chunk_size: int = 7):
+    """Rows read from `data` sent in small chunks, so lines span several of them"""
+    async def stream():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    async def rows():
+        return [row async for row in reader(stream())]
+
+    return asyncio.run(rows())
+
+
+def test_invalid_utf8_is_a_row_error():
+    rows = read(read_csv, b'sku,name\na,first\nb,"\xff"\nc,third\n')
+
+    assert [row_number for row_number, _ in rows] == [1, 2, 3]
+    assert rows[0][1] == {"sku": "a", "name": "first"}
+    assert isinstance(rows[1][1], ValueError)
+    assert rows[2][1] == {"sku": "c", "name": "third"}
+
+
+def test_invalid_utf8_header_rejects_the_upload():
+    with pytest.raises(HTTPException) as error:
+        read(read_csv, b"\xffsku,name\na,first\n")
+
+    assert error.value.status_code == 400
+
+
+def test_long_lines_are_row_errors(monkeypatch):
+    monkeypatch.setattr(bulk, "IMPORT_MAX_RECORD_SIZE", 40)
+    data = b'{"sku": "a"}\n' + b"x" * 100 + b'\n{"sku": "c"}\n' + b"y" * 100
+    rows = read(read_ndjson, data)
+
+    assert rows[0] == (1, {"sku": "a"})
+    assert isinstance(rows[1][1], ValueError)
+    assert rows[2] == (3, {"sku": "c"})
+    assert rows[3][0] == 4 and isinstance(rows[3][1], ValueError)
+
+
+def test_long_multiline_records_are_row_errors(monkeypatch):
+    monkeypatch.setattr(bulk, "IMPORT_MAX_RECORD_SIZE", 40)
+    data = b'sku,name\na,"long\n' + b"y" * 30 + b"\n" + b"z" * 30 + b'"\nb,last\n'
+    rows = read(read_csv, data)
+
+    assert rows[0][0] == 1 and isinstance(rows[0][1], ValueError)
+    assert rows[1] == (2, {"sku": "b", "name": "last"})
+
+
+def test_quoted_fields_span_several_lines():
+    data = b'sku,description\r\na,"first line\r\nsecond line"\r\nb,"one ""quoted"" word,\nthen ""more"""\r\nc,plain\r\n'
+    rows = read(read_csv, data)
+
+    assert rows == [
+        (1, {"sku": "a", "description": "first line\nsecond line"}),
+        (2, {"sku": "b", "description": 'one "quoted" word,\nthen "more"'}),
+        (3, {"sku": "c", "description": "plain"}),
+    ]
+
+
+def test_header_is_normalized():
+    rows = read(read_csv, "\ufeffSKU , Name\na,first\n".encode())
+
+    assert rows == [(1, {"sku": "a", "name": "first"})]
+
+
+def test_field_count_mismatch_is_a_row_error():
+    rows = read(read_csv, b'sku,name\na\nb,"second\nline"\n')
+
+    assert isinstance(rows[0][1], ValueError)
+    assert rows[1] == (2, {"sku": "b", "name": "second\nline"})
+
+
+def test_unterminated_quoted_field_is_a_row_error():
+    rows = read(read_csv, b'sku,name\na,first\nb,"never closed\nc,third\n')
+
+    assert rows[0] == (1, {"sku": "a", "name": "first"})
+    assert rows[1][0] == 2 and isinstance(rows[1][1], ValueError)
+
+
+def test_quotes_inside_unquoted_fields_are_characters():
+    data = b'sku,name\na,TV 5" screen\nb,"Monitor, 27"""\nc,Cable 2" to 3" adapter\nd,last\n'
+    rows = read(read_csv, data)
+
+    assert rows == [
+        (1, {"sku": "a", "name": 'TV 5" screen'}),
+        (2, {"sku": "b", "name": 'Monitor, 27"'}),
+        (3, {"sku": "c", "name": 'Cable 2" to 3" adapter'}),
+        (4, {"sku": "d", "name": "last"}),
+    ]
+
+
+def test_fields_the_csv_module_rejects_are_row_errors():
+    data = b"sku,name\na,short\nb," + b"x" * 20 + b"\nc,short\n"
+    limit = csv.field_size_limit(10)
+    try:
+        rows = read(read_csv, data)
+    finally:
+        csv.field_size_limit(limit)
+
+    assert rows[0] == (1, {"sku": "a", "name": "short"})
+    assert rows[1][0] == 2 and isinstance(rows[1][1], ValueError)
+    assert rows[2] == (3, {"sku": "c", "name": "short"})
+
+
+def test_connections_are_borrowed_per_chunk(monkeypatch):
+    events = []
+
+    @contextlib.asynccontextmanager
+    async def get_db_connection():
+        events.append("borrow")
+        yield FakeConnection()
+
+    async def copy_products(conn, user, products):
+        events.append(len(products))
+
+    monkeypatch.setattr(bulk, "get_db_connection", get_db_connection)
+    monkeypatch.setattr(bulk, "copy_products", copy_products)
+    monkeypatch.setattr(bulk, "IMPORT_CHUNK_SIZE", 2)
+    monkeypatch.setattr(bulk, "parse_row", lambda row: row)
+
+    async def rows():
+        for row_number in range(1, 6):
+            events.append(f"read {row_number}")
+            yield row_number, {"sku": str(row_number)}
+
+    user = Enterprise(id=uuid4(), name="Test",
+                      surname="Seller", nif="B00000000")
+    result = asyncio.run(bulk.import_products(user, rows()))
+
+    assert result["imported"] == 5 and result["committed"] == 5
+    assert events == ["read 1", "read 2", "borrow", 2, "read 3",
+                      "read 4", "borrow", 2, "read 5", "borrow", 1]
+
+
+class FakeConnection:
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
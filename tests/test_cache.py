@@ -0,0 +1,171 @@
+import asyncio
+from typing import Optional
+
+import pytest
+
+from cache import RefreshingCache, SingleFlight
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight(timeout=1)
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", load) for _ in range(3)))
+
+    assert asyncio.run(main()) == [1, 1, 1]
+    assert flight.stats() == {"in_flight": 0,
+                              "calls": 1, "shared": 2, "timeouts": 0}
+
+
+def test_single_flight_hands_the_error_to_every_caller():
+    flight = SingleFlight(timeout=1)
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database unavailable")
+
+    async def main():
+        results = await asyncio.gather(
+            *(flight.do("key", fail) for _ in range(2)), return_exceptions=True)
+        # Failed calls are forgotten, the next one runs again
+        again = await flight.do("key", lambda: asyncio.sleep(0))
+        return results, again
+
+    results, again = asyncio.run(main())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert again is None
+    assert flight.calls == 2
+
+
+def test_single_flight_timeout_does_not_cancel_the_call():
+    flight = SingleFlight(timeout=0.01)
+    started = 0
+
+    async def load():
+        nonlocal started
+        started += 1
+        await asyncio.sleep(0.05)
+        return "loaded"
+
+    async def main():
+        impatient = asyncio.create_task(flight.do("key", load))
+        patient = asyncio.create_task(flight.do("key", load, timeout=1))
+        with pytest.raises(asyncio.TimeoutError):
+            await impatient
+        return await patient
+
+    assert asyncio.run(main()) == "loaded"
+    assert started == 1
+    assert flight.timeouts == 1
+
+
+def test_single_flight_per_call_timeout():
+    flight = SingleFlight(timeout=10)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await flight.do("key", lambda: asyncio.sleep(1), timeout=0.01)
+
+    asyncio.run(main())
+    assert flight.timeouts == 1
+
+
+class Loader:
+    """Returns the number of times it was called, optionally waiting on `release` first"""
+
+    def __init__(self, release: Optional[asyncio.Event] = None):
+        self.calls = 0
+        self.release = release
+
+    async def __call__(self):
+        self.calls += 1
+        calls = self.calls
+        if self.release is not None:
+            await self.release.wait()
+        return calls
+
+
+def test_refreshing_cache_serves_fresh_entries():
+    cache = RefreshingCache(max_size=10, ttl=60, stale_ttl=60)
+    loader = Loader()
+
+    async def main():
+        return [await cache.get("key", loader) for _ in range(3)]
+
+    assert asyncio.run(main()) == [1, 1, 1]
+    assert loader.calls == 1
+
+
+def test_refreshing_cache_serves_stale_entries_while_refreshing():
+    cache = RefreshingCache(max_size=10, ttl=60, stale_ttl=60)
+    loader = Loader()
+
+    async def main():
+        await cache.get("key", loader)
+        cache.expire()
+        stale = await cache.get("key", loader)
+        # Let the background refresh finish
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return stale, await cache.get("key", loader)
+
+    assert asyncio.run(main()) == (1, 2)
+    assert cache.stats()["stale_hits"] == 1
+
+
+def test_refreshing_cache_stores_values_loaded_before_expire_as_stale():
+    cache = RefreshingCache(max_size=10, ttl=60, stale_ttl=60)
+
+    async def main():
+        loader = Loader(asyncio.Event())
+        loading = asyncio.create_task(cache.get("key", loader))
+        await asyncio.sleep(0)
+        cache.expire()
+        loader.release.set()
+        first = await loading
+
+        # Served, but refreshed in the background
+        second = await cache.get("key", loader)
+        await asyncio.sleep(0)
+        return first, second, loader.calls
+
+    assert asyncio.run(main()) == (1, 1, 2)
+
+
+def test_refreshing_cache_clear_discards_values_loaded_before_it():
+    cache = RefreshingCache(max_size=10, ttl=60, stale_ttl=60)
+
+    async def main():
+        loader = Loader(asyncio.Event())
+        loading = asyncio.create_task(cache.get("key", loader))
+        await asyncio.sleep(0)
+        cache.clear()
+        loader.release.set()
+        first = await loading
+
+        # Nothing served from before the clear, not even stale
+        second = await cache.get("key", loader)
+        return first, second
+
+    assert asyncio.run(main()) == (1, 2)
+
+
+def test_refreshing_cache_without_stale_entries_drops_them_on_expire():
+    cache = RefreshingCache(max_size=10, ttl=60, stale_ttl=0)
+    loader = Loader()
+
+    async def main():
+        first = await cache.get("key", loader)
+        cache.expire()
+        return first, await cache.get("key", loader)
+
+    assert asyncio.run(main()) == (1, 2)
+    assert cache.stats()["stale_hits"] == 0
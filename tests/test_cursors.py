@@ -0,0 +1,86 @@
+import base64
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from model.product.product import Product, decode_cursor, encode_cursor
+from model.purchase import decode_history_cursor, encode_history_cursor
+
+
+def listing_row(price=Decimal("19.99"), created_at=datetime(2025, 3, 1, 12, 30, tzinfo=timezone.utc), rank=0.0607927):
+    """Row of a listing query, only the id and the sort key columns are read"""
+    return (uuid4(), None, None, None, price, created_at, rank)
+
+
+@pytest.mark.parametrize("sort, key", [
+    (Product.Sort.RELEVANCE, 6),
+    (Product.Sort.NEWEST, 5),
+    (Product.Sort.PRICE_ASC, 4),
+    (Product.Sort.PRICE_DESC, 4),
+])
+def test_cursor_round_trip(sort, key):
+    row = listing_row()
+
+    assert decode_cursor(sort, encode_cursor(sort, row)) == (row[key], row[0])
+
+
+def test_cursor_keeps_float_precision():
+    row = listing_row(rank=0.1 + 0.2)
+    rank, _ = decode_cursor(Product.Sort.RELEVANCE,
+                            encode_cursor(Product.Sort.RELEVANCE, row))
+
+    assert rank == row[6]
+
+
+def encode(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+@pytest.mark.parametrize("page_cursor", [
+    "not a cursor",
+    "",
+    encode(None),
+    encode(["price_asc", "19.99"]),
+    encode(["price_asc", "cheap", str(uuid4())]),
+    encode(["price_asc", "19.99", "not a uuid"]),
+    encode(["newest", "yesterday", str(uuid4())]),
+])
+def test_invalid_cursors_are_rejected(page_cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(Product.Sort.PRICE_ASC, page_cursor)
+
+    assert error.value.status_code == 400
+
+
+def test_cursor_of_another_sort_is_rejected():
+    page_cursor = encode_cursor(Product.Sort.PRICE_ASC, listing_row())
+
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(Product.Sort.PRICE_DESC, page_cursor)
+
+    assert error.value.status_code == 400
+
+
+def test_history_cursor_round_trip():
+    purchase = {"id": uuid4(), "date": datetime(
+        2025, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)}
+
+    assert decode_history_cursor(encode_history_cursor(
+        purchase)) == (purchase["date"], purchase["id"])
+
+
+@pytest.mark.parametrize("page_cursor", [
+    "not a cursor",
+    encode([1, 2]),
+    encode(["2025-03-01T12:30:00+00:00"]),
+    encode(["2025-03-01T12:30:00+00:00", "not a uuid"]),
+])
+def test_invalid_history_cursors_are_rejected(page_cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_history_cursor(page_cursor)
+
+    assert error.value.status_code == 400
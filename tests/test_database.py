@@ -0,0 +1,98 @@
+import asyncio
+import contextlib
+
+import pytest
+
+import database
+from cache import TTLCache
+from database import Replica, get_read_connection, note_write
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+
+    async def fetchone(self):
+        return self.row
+
+
+class FakePool:
+    """Hands out its own name as the connection, or answers the lag query with `lag`"""
+
+    def __init__(self, name, lag=0.0):
+        self.name = name
+        self.lag = lag
+
+    @contextlib.asynccontextmanager
+    async def connection(self, timeout=None):
+        if isinstance(self.lag, Exception):
+            raise self.lag
+        yield self
+
+    async def execute(self, query):
+        return FakeCursor((self.lag,))
+
+
+def replica(name, in_rotation=True, lag=0.0):
+    replica = Replica(f"postgresql://app@{name}:5432/chopchop")
+    replica.pool = FakePool(name, lag)
+    replica.in_rotation = in_rotation
+    return replica
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    replicas = [replica("busy"), replica("idle"),
+                replica("behind", in_rotation=False)]
+    replicas[0].in_flight = 3
+    monkeypatch.setattr(database, "pool", FakePool("primary"))
+    monkeypatch.setattr(database, "replicas", replicas)
+    monkeypatch.setattr(database, "recent_writes",
+                        TTLCache(max_size=100, ttl=60))
+    return replicas
+
+
+def read(*keys):
+    async def main():
+        async with get_read_connection(*keys) as conn:
+            return conn.name
+
+    return asyncio.run(main())
+
+
+def test_reads_go_to_the_least_busy_replica_in_rotation(replicas):
+    assert read() == "idle"
+
+    replicas[1].in_rotation = False
+    assert read() == "busy"
+
+    replicas[0].in_rotation = False
+    assert read() == "primary"
+
+
+def test_recent_writes_are_read_from_the_primary(replicas):
+    note_write(("user", 1))
+
+    assert read(("user", 1)) == "primary"
+    assert read(("user", 2), ("product", 1)) == "idle"
+    assert read() == "idle"
+
+
+def test_writes_are_not_noted_without_replicas(monkeypatch, replicas):
+    monkeypatch.setattr(database, "replicas", [])
+    note_write(("user", 1))
+
+    assert database.recent_writes.get(("user", 1)) is None
+
+
+@pytest.mark.parametrize("lag, in_rotation", [
+    (0.0, True),
+    (database.REPLICA_MAX_LAG + 1, False),
+    (ConnectionError("unreachable"), False),
+])
+def test_checks_put_replicas_in_and_out_of_rotation(lag, in_rotation):
+    checked = replica("replica", in_rotation=not in_rotation, lag=lag)
+    asyncio.run(checked.check())
+
+    assert checked.in_rotation is in_rotation
+    assert checked.lag == (None if isinstance(lag, Exception) else lag)
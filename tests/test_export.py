@@ -0,0 +1,38 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import uuid4
+
+from model.product.export import COLUMNS, ExportFormat, encode_rows
+
+CHANGED = datetime(2025, 3, 1, 12, 30, tzinfo=timezone.utc)
+
+
+def rows():
+    product = (uuid4(), "verified", "Lamp", "A lamp", "https://example.com/lamp.jpg",
+               Decimal("19.99"), "mobles", CHANGED, CHANGED, False, 10)
+    deleted = (uuid4(), None, None, None, None,
+               None, None, None, None, True, 11)
+    return product, deleted
+
+
+def test_ndjson_tombstones_only_have_the_id():
+    product, deleted = rows()
+    lines = [json.loads(line) for line in encode_rows(
+        ExportFormat.NDJSON, [product, deleted]).splitlines()]
+
+    assert lines[0]["price"] == 19.99 and lines[0]["deleted"] is False
+    assert lines[1] == {"id": str(deleted[0]), "deleted": True}
+
+
+def test_csv_tombstones_have_empty_fields():
+    product, deleted = rows()
+    records = list(csv.reader(io.StringIO(encode_rows(
+        ExportFormat.CSV, [product, deleted], header=True))))
+
+    assert records[0] == COLUMNS
+    assert records[1][-1] == "false" and records[1][2] == "Lamp"
+    assert records[2] == [str(deleted[0]), "", "", "",
+                          "", "", "", "", "", "true"]
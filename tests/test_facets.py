@@ -0,0 +1,64 @@
+import asyncio
+from decimal import Decimal
+
+from model.product.product import Product
+
+
+class FakeCursor:
+    """Answers the bucket counts, then the price counts, recording the queries"""
+
+    def __init__(self, buckets, prices):
+        self.results = [buckets, prices]
+        self.parameters = []
+
+    async def execute(self, query, parameters=None):
+        self.parameters.append(parameters)
+
+    async def fetchall(self):
+        return self.results.pop(0)
+
+
+BUCKETS = [
+    ("electronica", Decimal(5), 4),
+    ("electronica", Decimal(10), 6),
+    ("electronica", Decimal(20), 8),
+    ("roba", Decimal(10), 3),
+    ("roba", Decimal(5000), 1),
+]
+
+
+def count_facets(cursor, category, price_min, price_max):
+    return asyncio.run(Product.count_facets(cursor, category, price_min, price_max))
+
+
+def test_whole_buckets_are_counted_from_the_bucket_counts():
+    # 7.5 to 25 covers the 10 to 20 bucket, 5 to 10 and 20 to 50 are cut
+    cursor = FakeCursor(BUCKETS, [("electronica", 5)])
+    facets = count_facets(cursor, None, 7.5, 25.0)
+
+    assert cursor.parameters[1] == [7.5, 10, 20, 25.0]
+    assert facets["categories"] == {"electronica": 11, "roba": 3}
+    assert facets["total"] == 14
+    assert [bucket["min"] for bucket in facets["price"]] == [5, 10, 20, 5000]
+    assert facets["price"][-1] == {"min": 5000, "max": None, "count": 1}
+
+
+def test_histogram_and_total_follow_the_category():
+    cursor = FakeCursor(BUCKETS, [])
+    facets = count_facets(cursor, Product.Category("roba"), 0.0, float("inf"))
+
+    assert facets["categories"] == {"electronica": 18, "roba": 4}
+    assert facets["total"] == 4
+    assert facets["price"] == [
+        {"min": 10, "max": 20, "count": 3},
+        {"min": 5000, "max": None, "count": 1},
+    ]
+
+
+def test_filters_inside_a_bucket_read_the_prices():
+    cursor = FakeCursor(BUCKETS, [("electronica", 2)])
+    facets = count_facets(cursor, None, 11.0, 12.0)
+
+    assert cursor.parameters[1] == [11.0, 12.0]
+    assert facets["categories"] == {"electronica": 2}
+    assert facets["total"] == 2
@@ -0,0 +1,117 @@
+import asyncio
+import contextlib
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+import idempotency
+from idempotency import fingerprint, run_once
+from model.user import Particular
+
+
+class FakeCursor:
+    async def execute(self, query, parameters=None):
+        pass
+
+
+class FakeConnection:
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+    @contextlib.asynccontextmanager
+    async def cursor(self):
+        yield FakeCursor()
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Keys claimed so far, a stored request is (fingerprint, response)"""
+    stored = {}
+    borrowed = []
+
+    @contextlib.asynccontextmanager
+    async def get_db_connection():
+        borrowed.append(True)
+        yield FakeConnection()
+
+    async def claim(cursor, user, key, endpoint, request_fingerprint):
+        if (user.id, key) in stored:
+            return (*stored[(user.id, key)], True)
+        stored[(user.id, key)] = (request_fingerprint, None)
+        return None
+
+    monkeypatch.setattr(idempotency, "get_db_connection", get_db_connection)
+    monkeypatch.setattr(idempotency, "claim", claim)
+    return stored, borrowed
+
+
+def buyer():
+    return Particular(id=uuid4(), name="Test", surname="Buyer")
+
+
+def purchase(runs):
+    async def run(cursor):
+        runs.append(True)
+        await asyncio.sleep(0.01)
+        return {"purchase_id": len(runs)}
+    return run
+
+
+def test_retries_get_the_stored_response_from_the_cache(database):
+    _, borrowed = database
+    user, runs = buyer(), []
+
+    async def main():
+        first = await run_once(user, "key", "purchase", {"items": 1}, purchase(runs))
+        second = await run_once(user, "key", "purchase", {"items": 1}, purchase(runs))
+        return first, second
+
+    assert asyncio.run(main()) == (
+        ({"purchase_id": 1}, False), ({"purchase_id": 1}, True))
+    assert len(runs) == 1
+    assert len(borrowed) == 1
+
+
+def test_concurrent_duplicates_share_the_first_request(database):
+    user, runs = buyer(), []
+
+    async def main():
+        return await asyncio.gather(
+            *(run_once(user, "key", "purchase", {"items": 1}, purchase(runs)) for _ in range(3)))
+
+    results = asyncio.run(main())
+
+    assert [replayed for _, replayed in results] == [False, True, True]
+    assert len(runs) == 1
+
+
+def test_keys_claimed_by_other_workers_are_replays(database):
+    stored, _ = database
+    user, runs = buyer(), []
+    stored[(user.id, "key")] = (fingerprint(
+        "purchase", {"items": 1}), {"purchase_id": 7})
+
+    result = asyncio.run(run_once(user, "key", "purchase",
+                         {"items": 1}, purchase(runs)))
+
+    assert result == ({"purchase_id": 7}, True)
+    assert not runs
+
+
+def test_keys_reused_with_a_different_request_are_rejected(database):
+    user, runs = buyer(), []
+
+    async def main():
+        await run_once(user, "key", "purchase", {"items": 1}, purchase(runs))
+        # From the cache, then from the database
+        for clear in (False, True):
+            if clear:
+                idempotency.idempotency_cache.clear()
+            with pytest.raises(HTTPException) as error:
+                await run_once(user, "key", "purchase", {"items": 2}, purchase(runs))
+            assert error.value.status_code == 422
+
+    asyncio.run(main())
+    assert len(runs) == 1
@@ -0,0 +1,126 @@
+import asyncio
+from uuid import uuid4
+
+import psycopg
+import pytest
+
+import database
+import invalidation
+from cache import TTLCache
+from invalidation import handle_notification, set_listening
+from model.product.listing import listing_cache
+from model.product.product import product_cache
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    # Writes are only noted when there are replicas to keep the reads from
+    monkeypatch.setattr(database, "replicas", [object()])
+    monkeypatch.setattr(database, "recent_writes",
+                        TTLCache(max_size=100, ttl=60))
+    yield
+    set_listening(True)
+
+
+def notify(channel, payload=""):
+    return psycopg.Notify(channel, payload, 0)
+
+
+def test_product_changes_evict_the_product_and_pin_its_reads():
+    product_id = uuid4()
+    product_cache.set(product_id, {"name": "cached"})
+
+    handle_notification(notify(invalidation.PRODUCT_CHANNEL, str(product_id)))
+
+    assert product_cache.get(product_id) is None
+    assert database.recent_writes.get(("product", product_id))
+
+
+def test_user_writes_pin_their_reads():
+    user_id = uuid4()
+
+    handle_notification(notify(invalidation.USER_CHANNEL, str(user_id)))
+
+    assert database.recent_writes.get(("user", user_id))
+
+
+def test_catalog_changes_turn_the_listing_pages_stale():
+    async def main():
+        calls = []
+
+        async def load():
+            calls.append(True)
+            return len(calls)
+
+        await listing_cache.get("page", load)
+        handle_notification(notify(invalidation.CATALOG_CHANNEL))
+        stale = await listing_cache.get("page", load)
+        await asyncio.sleep(0)
+        return stale, await listing_cache.get("page", load)
+
+    assert asyncio.run(main()) == (1, 2)
+
+
+def test_caches_are_short_lived_while_not_listening():
+    product_id = uuid4()
+    product_cache.set(product_id, {"name": "cached"})
+    ttl = product_cache.ttl
+
+    set_listening(False)
+    assert product_cache.get(product_id) is None
+    assert product_cache.ttl == min(ttl, invalidation.FALLBACK_TTL)
+    assert listing_cache.ttl <= invalidation.FALLBACK_TTL
+
+    set_listening(True)
+    assert product_cache.ttl == ttl
+
+
+class FakeConnection:
+    """Never receives notifications, a dead one never answers SELECT 1 either"""
+
+    def __init__(self, alive):
+        self.alive = alive
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def execute(self, query):
+        if query == "SELECT 1" and not self.alive:
+            await asyncio.Event().wait()
+
+    async def notifies(self, timeout=None):
+        await asyncio.sleep(timeout)
+        return
+        yield
+
+
+def test_silent_connections_are_replaced(monkeypatch):
+    connections = []
+
+    class AsyncConnection:
+        @staticmethod
+        async def connect(url, autocommit):
+            # The first connection dropped without the server closing it
+            connections.append(FakeConnection(alive=bool(connections)))
+            return connections[-1]
+
+    monkeypatch.setattr(invalidation.psycopg,
+                        "AsyncConnection", AsyncConnection)
+    monkeypatch.setattr(invalidation, "CHECK_INTERVAL", 0.01)
+    monkeypatch.setattr(invalidation, "CHECK_TIMEOUT", 0.01)
+    monkeypatch.setattr(invalidation, "MIN_BACKOFF", 0.01)
+
+    async def main():
+        listener = asyncio.create_task(
+            invalidation.listen_for_changes("postgresql://"))
+        while len(connections) < 2:
+            await asyncio.sleep(0.01)
+        # Still using the second one, whose checks succeed
+        await asyncio.sleep(0.1)
+        listener.cancel()
+
+    asyncio.run(asyncio.wait_for(main(), 2))
+    assert len(connections) == 2
@@ -0,0 +1,32 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from model.purchase import Purchase
+from model.user import Particular
+
+
+class NoDatabaseCursor:
+    async def execute(self, *args, **kwargs):
+        raise AssertionError(
+            "Invalid items must be rejected before any statement runs")
+
+
+@pytest.mark.parametrize("count, paid", [(-1000, 1.0), (0, 1.0), (1, -1.0)])
+def test_item_rejects_non_positive_counts_and_negative_prices(count, paid):
+    with pytest.raises(ValidationError):
+        Purchase.PurchaseItem(product_id=uuid4(), count=count, paid=paid)
+
+
+def test_insert_rejects_unvalidated_negative_counts():
+    user = Particular(id=uuid4(), name="Test", surname="Buyer")
+    item = Purchase.PurchaseItem.model_construct(
+        product_id=uuid4(), count=-1000, paid=1.0)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(Purchase(user).insert(NoDatabaseCursor(), [item]))
+
+    assert error.value.status_code == 400
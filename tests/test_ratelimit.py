@@ -0,0 +1,60 @@
+from uuid import uuid4
+
+import jwt
+import pytest
+from fastapi import APIRouter, FastAPI
+
+from auth import ALGORITHM, SECRET_KEY
+from ratelimit import client_key, matched_route
+
+
+def scope_with_token(payload):
+    token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+    return {
+        "type": "http",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+        "client": ("203.0.113.7", 50000),
+    }
+
+
+@pytest.mark.parametrize("payload", [
+    {"sub": str(uuid4()), "type": "unknown"},
+    {"type": "particular"},
+    {"sub": "not a uuid", "type": "particular"},
+])
+def test_unusable_tokens_are_limited_by_address(payload):
+    key, _, _ = client_key(scope_with_token(payload))
+
+    assert key == "ip:203.0.113.7"
+
+
+def test_valid_tokens_are_limited_by_user():
+    user_id = uuid4()
+    key, _, _ = client_key(scope_with_token(
+        {"sub": str(user_id), "type": "particular", "name": "Test", "surname": "Buyer"}))
+
+    assert key == f"user:{user_id}"
+
+
+def test_limited_requests_are_matched_to_their_route():
+    router = APIRouter()
+
+    @router.get("/product/{product_id}")
+    async def get_product(product_id: str):
+        pass
+
+    app = FastAPI()
+    app.include_router(router)
+
+    def scope(method, path):
+        return {"type": "http", "method": method, "path": path, "root_path": "", "app": app}
+
+    _, route = matched_route(scope("GET", f"/product/{uuid4()}"))
+    assert route.path == "/product/{product_id}"
+
+    # Wrong method, still the route's template, answered 405 by the router
+    _, route = matched_route(scope("DELETE", f"/product/{uuid4()}"))
+    assert route.path == "/product/{product_id}"
+
+    _, route = matched_route(scope("GET", "/nowhere"))
+    assert route is None
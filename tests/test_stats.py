@@ -0,0 +1,29 @@
+from uuid import uuid4
+
+import jwt
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.stats.get import router
+from auth import ALGORITHM, SECRET_KEY
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+def headers(user_type):
+    token = jwt.encode({"sub": str(uuid4()), "type": user_type, "name": "Test", "surname": "User"},
+                       SECRET_KEY, algorithm=ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_stats_need_a_token():
+    assert client.get("/stats/database").status_code == 401
+
+
+def test_stats_answer_admins_only():
+    assert client.get("/stats/database",
+                      headers=headers("particular")).status_code == 403
+    assert client.get("/stats/auth", headers=headers("admin")
+                      ).status_code == 200